@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'name', 'status', 'attempts', 'created', 'run_at', 'finished'
+    )
+    list_filter = ('status',)
+    search_fields = ('name', 'dedupe_key')
+    ordering = ('-pk',)
+    readonly_fields = ('created',)
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,406 @@
+"""Двухуровневый кэш: LRU в памяти процесса поверх общего файла SQLite.
+
+L2 - таблица в отдельном файле SQLite (LOCATION), общем для всех
+процессов на машине: страница, собранная одним воркером gunicorn,
+достаётся остальным, а новое значение или удаление видят все.
+L1 - ограниченный по объёму LRU в памяти процесса.
+
+У каждой записи L2 есть штамп версии, новый при каждой записи. Запись
+L1 помнит свой штамп и отдаётся без обращения к L2 не дольше
+RECHECK_INTERVAL секунд, а потом сверяется с L2 запросом, который
+возвращает значение, только если штамп изменился. Поэтому свои записи
+процесс видит сразу, а чужие - не позже чем через RECHECK_INTERVAL.
+
+LOCATION ":memory:" - L2 в памяти процесса, без общего файла; так
+кэш настроен для тестов, см. TESTING в settings.
+"""
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+COUNTERS = ('l1_hits', 'rechecks', 'l2_hits', 'misses', 'sets', 'deletes')
+# Счётчики процесса добавляются к общим в L2 не чаще раза в столько секунд.
+STATS_FLUSH_INTERVAL = 10
+# Раз во столько записей из L2 удаляются истёкшие записи.
+CULL_EVERY = 100
+# Ограничение SQLite на число параметров запроса.
+CHUNK_SIZE = 400
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, '
+    'stamp INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE TABLE IF NOT EXISTS counters ('
+    'name TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+]
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _stamp():
+    return random.getrandbits(62)
+
+
+def _expired(expires, now):
+    return expires is not None and expires <= now
+
+
+@contextmanager
+def _transaction(db):
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+
+class LRU:
+    """L1: записи [pickle, штамп, срок, время проверки] в порядке
+    использования, вместе не больше max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, stamp, expires, checked):
+        self.pop(key)
+        # Одна большая запись не должна вытеснять весь L1.
+        if len(value) > self.max_bytes // 8:
+            return
+        self.entries[key] = [value, stamp, expires, checked]
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, (old, *_) = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+class Store:
+    """Соединение с L2, L1 и счётчики одного файла кэша в процессе.
+
+    Общий для всех потоков процесса; обращения идут под `lock`.
+    """
+
+    def __init__(self, path, l1_bytes):
+        self.path = path
+        self.lock = threading.RLock()
+        self.l1 = LRU(l1_bytes)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.unflushed = dict.fromkeys(COUNTERS, 0)
+        self.flushed_at = time.monotonic()
+        self.writes = 0
+        self.pid = None
+        self._db = None
+
+    @property
+    def db(self):
+        # После fork соединение и L1 родителя не годятся.
+        if self.pid != os.getpid():
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None,
+                check_same_thread=False,
+            )
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                self._db.execute(statement)
+            self.l1.clear()
+            self.pid = os.getpid()
+        return self._db
+
+    def count(self, name, number=1):
+        self.counts[name] += number
+        self.unflushed[name] += number
+        if time.monotonic() - self.flushed_at > STATS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        rows = [(name, n) for name, n in self.unflushed.items() if n]
+        if rows:
+            self.db.executemany(
+                'INSERT INTO counters (name, value) VALUES (?, ?) '
+                'ON CONFLICT (name) DO UPDATE '
+                'SET value = value + excluded.value',
+                rows,
+            )
+        self.unflushed = dict.fromkeys(COUNTERS, 0)
+        self.flushed_at = time.monotonic()
+
+
+class TwoTierCache(BaseCache):
+    """Бэкенд кэша Django с L1 в процессе и L2 в файле SQLite.
+
+    OPTIONS: MAX_ENTRIES и CULL_FREQUENCY - для L2, L1_MAX_BYTES - объём
+    L1 в байтах pickle, RECHECK_INTERVAL - секунды, которые запись L1
+    отдаётся без сверки с L2.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._location = location
+        self._l1_bytes = int(options.get('L1_MAX_BYTES', 32 * 1024 * 1024))
+        self._recheck = float(options.get('RECHECK_INTERVAL', 1))
+
+    @property
+    def _store(self):
+        path = self._location
+        with _stores_lock:
+            if path not in _stores:
+                _stores[path] = Store(path, self._l1_bytes)
+            return _stores[path]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _lookup(self, keys):
+        """{ключ: pickle} найденных живых записей."""
+        store, now = self._store, time.time()
+        found, stale = {}, {}
+        with store.lock:
+            db = store.db
+            for key in keys:
+                entry = store.l1.get(key)
+                if entry is None or _expired(entry[2], now):
+                    stale[key] = None
+                elif now - entry[3] < self._recheck:
+                    found[key] = entry[0]
+                    store.count('l1_hits')
+                else:
+                    stale[key] = entry[1]
+            pending = list(stale.items())
+            for start in range(0, len(pending), CHUNK_SIZE):
+                chunk = pending[start:start + CHUNK_SIZE]
+                values = ', '.join(['(?, ?)'] * len(chunk))
+                rows = db.execute(
+                    f'WITH wanted (key, stamp) AS (VALUES {values}) '
+                    f'SELECT cache.key, cache.stamp, cache.expires, '
+                    f'CASE WHEN cache.stamp IS wanted.stamp '
+                    f'THEN NULL ELSE cache.value END '
+                    f'FROM wanted JOIN cache ON cache.key = wanted.key',
+                    [item for pair in chunk for item in pair],
+                )
+                for key, stamp, expires, value in rows:
+                    if _expired(expires, now):
+                        continue
+                    if value is None:
+                        entry = store.l1.get(key)
+                        if entry is None:
+                            # Вытеснена записями, прочитанными выше.
+                            continue
+                        entry[3] = now
+                        found[key] = entry[0]
+                        store.count('rechecks')
+                    else:
+                        store.l1.put(key, value, stamp, expires, now)
+                        found[key] = value
+                        store.count('l2_hits')
+            for key in stale.keys() - found.keys():
+                store.l1.pop(key)
+                store.count('misses')
+        return found
+
+    def _write(self, rows):
+        store, now = self._store, time.time()
+        rows = [(key, value, expires, _stamp())
+                for key, value, expires in rows]
+        with store.lock:
+            db = store.db
+            with _transaction(db):
+                db.executemany(
+                    'INSERT OR REPLACE INTO cache '
+                    '(key, value, expires, stamp) VALUES (?, ?, ?, ?)',
+                    rows,
+                )
+            for key, value, expires, stamp in rows:
+                store.l1.put(key, value, stamp, expires, now)
+            store.count('sets', len(rows))
+            store.writes += len(rows)
+            if store.writes >= CULL_EVERY:
+                store.writes = 0
+                self._cull(db)
+
+    def _cull(self, db):
+        with _transaction(db):
+            db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            count = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count > self._max_entries:
+                # Сначала те, что раньше истекут; бессрочные - последними.
+                db.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                    'ORDER BY expires IS NULL, expires LIMIT ?)',
+                    (count // self._cull_frequency
+                     if self._cull_frequency else count,),
+                )
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        value = self._lookup([key]).get(key)
+        return default if value is None else pickle.loads(value)
+
+    def get_many(self, keys, version=None):
+        names = {self._key(key, version): key for key in keys}
+        return {
+            names[key]: pickle.loads(value)
+            for key, value in self._lookup(list(names)).items()
+        }
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return key in self._lookup([key])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write([(
+            self._key(key, version),
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            self.get_backend_timeout(timeout),
+        )])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        self._write([
+            (
+                self._key(key, version),
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                expires,
+            )
+            for key, value in data.items()
+        ])
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        store, now = self._store, time.time()
+        key = self._key(key, version)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires, stamp = self.get_backend_timeout(timeout), _stamp()
+        with store.lock:
+            db = store.db
+            with _transaction(db):
+                db.execute(
+                    'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                    (key, now),
+                )
+                added = db.execute(
+                    'INSERT OR IGNORE INTO cache (key, value, expires, stamp) '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, value, expires, stamp),
+                ).rowcount == 1
+            if added:
+                store.l1.put(key, value, stamp, expires, now)
+                store.count('sets')
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        """Атомарно для всех процессов: чтение и запись в одной транзакции
+        с блокировкой записи в L2.
+        """
+        store, now = self._store, time.time()
+        key = self._key(key, version)
+        with store.lock:
+            db = store.db
+            with _transaction(db):
+                row = db.execute(
+                    'SELECT value, expires FROM cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None or _expired(row[1], now):
+                    raise ValueError(f"Key '{key}' not found")
+                new_value = pickle.loads(row[0]) + delta
+                value = pickle.dumps(new_value, pickle.HIGHEST_PROTOCOL)
+                stamp = _stamp()
+                db.execute(
+                    'UPDATE cache SET value = ?, stamp = ? WHERE key = ?',
+                    (value, stamp, key),
+                )
+            store.l1.put(key, value, stamp, row[1], now)
+            store.count('sets')
+        return new_value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        store, now = self._store, time.time()
+        key = self._key(key, version)
+        expires = self.get_backend_timeout(timeout)
+        with store.lock:
+            touched = store.db.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (expires, key, now),
+            ).rowcount == 1
+            entry = store.l1.get(key)
+            if entry is not None:
+                entry[2] = expires
+        return touched
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        store = self._store
+        keys = [self._key(key, version) for key in keys]
+        with store.lock:
+            db = store.db
+            with _transaction(db):
+                db.executemany(
+                    'DELETE FROM cache WHERE key = ?', [(key,) for key in keys]
+                )
+            for key in keys:
+                store.l1.pop(key)
+            store.count('deletes', len(keys))
+
+    def clear(self):
+        store = self._store
+        with store.lock:
+            store.db.execute('DELETE FROM cache')
+            store.l1.clear()
+
+    def stats(self):
+        """Счётчики обращений этого процесса и всех процессов вместе.
+
+        l1_hits - отдано из L1 без запроса, rechecks - из L1 после сверки
+        штампа, l2_hits - прочитано из L2, misses - промахи.
+        """
+        store = self._store
+        with store.lock:
+            store.flush()
+            total = dict(store.db.execute('SELECT name, value FROM counters'))
+        return {
+            'process': dict(store.counts),
+            'total': {name: total.get(name, 0) for name in COUNTERS},
+        }
+
+    def reset_stats(self):
+        store = self._store
+        with store.lock:
+            store.db.execute('DELETE FROM counters')
+            store.counts = dict.fromkeys(COUNTERS, 0)
+            store.unflushed = dict.fromkeys(COUNTERS, 0)
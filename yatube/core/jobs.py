@@ -0,0 +1,197 @@
+"""Фоновые задачи в таблице базы данных, без отдельного брокера.
+
+enqueue() записывает вызов функции в core_job в текущей транзакции:
+воркеры увидят задачу вместе с данными, ради которых она поставлена,
+а при откате она исчезнет вместе с ними. Команда run_workers забирает
+готовые задачи условным UPDATE (так несколько процессов не возьмут одну
+задачу дважды) и выполняет их в пуле потоков; упавшая задача
+повторяется с растущей задержкой, пока не кончатся попытки.
+
+С JOB_QUEUE_INLINE (так настроены тесты) задача выполняется сразу
+после коммита в том же процессе, без воркеров.
+"""
+import json
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Avg, Count, DurationField, ExpressionWrapper, F, Max, Min
+)
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def job_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, dedupe_key=None, delay=0, max_attempts=None):
+    """Ставит вызов func(*args) в очередь и возвращает задачу.
+
+    func - функция уровня модуля, аргументы должны переводиться в JSON.
+    Если задача с тем же dedupe_key ещё ждёт в очереди, новая не
+    ставится и возвращается None.
+    """
+    # Через JSON и при выполнении на месте: аргумент, который нельзя
+    # сохранить в очередь, должен падать и в тестах.
+    args = json.loads(json.dumps(args))
+    if settings.JOB_QUEUE_INLINE:
+        transaction.on_commit(lambda: _run_inline(func, args))
+        return None
+    job = Job(
+        name=job_name(func),
+        payload=json.dumps(args),
+        dedupe_key=dedupe_key,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if dedupe_key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def _run_inline(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Job %s failed', job_name(func))
+
+
+def claim(limit):
+    """Забирает до limit готовых задач, старые первыми."""
+    now = timezone.now()
+    candidates = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=now
+    ).order_by('run_at', 'id').values_list('pk', flat=True)[:limit]
+    claimed = [
+        pk for pk in candidates
+        # Задачу получает тот воркер, чей UPDATE изменил строку.
+        if Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, started=now, attempts=F('attempts') + 1
+        )
+    ]
+    return list(Job.objects.filter(pk__in=claimed).order_by('run_at', 'id'))
+
+
+def run(job):
+    """Выполняет взятую задачу и записывает результат."""
+    try:
+        import_string(job.name)(*json.loads(job.payload))
+    except Exception:
+        fail(job, traceback.format_exc())
+        return False
+    finished = timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.DONE, finished=finished, last_error=''
+    )
+    logger.info(
+        'Job %s done in %.3fs after %.3fs in the queue', job,
+        (finished - job.started).total_seconds(),
+        (job.started - job.run_at).total_seconds(),
+    )
+    return True
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой.
+
+    Растёт вдвое с каждой попыткой и случайна в пределах половины, чтобы
+    задачи, упавшие вместе (например, из-за блокировки базы), не
+    повторялись тоже вместе.
+    """
+    delay = settings.JOB_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def fail(job, error):
+    if job.attempts >= job.max_attempts:
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED, finished=timezone.now(), last_error=error
+        )
+        logger.error('Job %s failed after %s attempts:\n%s',
+                     job, job.attempts, error)
+        return
+    logger.warning('Job %s failed, retrying:\n%s', job, error)
+    try:
+        with transaction.atomic():
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED,
+                run_at=timezone.now() + backoff(job.attempts),
+                last_error=error,
+            )
+    except IntegrityError:
+        # Пока задача выполнялась, такую же поставили снова - повторит та.
+        Job.objects.filter(pk=job.pk).delete()
+
+
+def recover():
+    """Возвращает в очередь задачи воркеров, пропавших не закончив их."""
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        started__lt=timezone.now() - timedelta(seconds=settings.JOB_LEASE),
+    )
+    for job in stale:
+        fail(job, f'Задача не закончилась за {settings.JOB_LEASE} с')
+
+
+def prune():
+    """Удаляет выполненные задачи старше JOB_KEEP_DONE."""
+    Job.objects.filter(
+        status=Job.DONE,
+        finished__lt=timezone.now() - timedelta(
+            seconds=settings.JOB_KEEP_DONE
+        ),
+    ).delete()
+
+
+def _seconds(value):
+    return value.total_seconds() if value is not None else None
+
+
+def stats(window=60 * 60):
+    """Глубина очереди и задержки задач, выполненных за window секунд.
+
+    `lag` - сколько ждёт самая старая готовая задача, `wait` - от момента,
+    когда задача стала готова, до её начала, `run` - время выполнения.
+    """
+    now = timezone.now()
+    result = dict.fromkeys(
+        [status for status, _ in Job.STATUS_CHOICES], 0
+    )
+    result.update(
+        Job.objects.order_by().values_list('status').annotate(Count('pk'))
+    )
+    oldest = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=now
+    ).aggregate(oldest=Min('run_at'))['oldest']
+    result['lag'] = _seconds(now - oldest) if oldest else 0
+
+    def duration(start, end):
+        return ExpressionWrapper(F(end) - F(start),
+                                 output_field=DurationField())
+    recent = Job.objects.filter(
+        status=Job.DONE, finished__gte=now - timedelta(seconds=window)
+    ).aggregate(
+        finished=Count('pk'),
+        wait=Avg(duration('run_at', 'started')),
+        wait_max=Max(duration('run_at', 'started')),
+        run=Avg(duration('started', 'finished')),
+        run_max=Max(duration('started', 'finished')),
+    )
+    result['finished'] = recent.pop('finished')
+    result.update({key: _seconds(value) for key, value in recent.items()})
+    return result
@@ -0,0 +1,28 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+READS = ('l1_hits', 'rechecks', 'l2_hits', 'misses')
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает попадания и промахи двухуровневого кэша, '
+        'сложенные по всем процессам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить счётчики после вывода.')
+
+    def handle(self, *args, **options):
+        if not hasattr(cache, 'stats'):
+            raise CommandError('Кэш default не TwoTierCache')
+        total = cache.stats()['total']
+        reads = sum(total[name] for name in READS)
+        for name, value in total.items():
+            share = ''
+            if reads and name in READS:
+                share = f' ({value / reads:.1%})'
+            self.stdout.write(f'{name:>9}: {value}{share}')
+        if options['reset']:
+            cache.reset_stats()
@@ -0,0 +1,98 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+
+# Как часто возвращать в очередь брошенные задачи и чистить старые.
+MAINTENANCE_INTERVAL = 60
+
+
+def work(job):
+    close_old_connections()
+    try:
+        return jobs.run(job)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет фоновые задачи из очереди core_job в пуле потоков. '
+        'Процессов с воркерами можно запустить несколько: задачу берёт '
+        'только один из них.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int,
+                            default=settings.JOB_WORKERS,
+                            help='Потоков в пуле; 0 - в этом потоке.')
+        parser.add_argument('--burst', action='store_true',
+                            help='Выйти, когда готовых задач не останется.')
+        parser.add_argument('--stats', action='store_true',
+                            help='Показать глубину очереди и задержки '
+                                 'за последний час и выйти.')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.show_stats()
+            return
+        done = self.serve(options['threads'], options['burst'])
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {done}'))
+
+    def serve(self, threads, burst):
+        """Цикл воркера; возвращает число успешно выполненных задач."""
+        pool = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='jobs'
+        ) if threads else None
+        running = set()
+        maintained = 0
+        done = 0
+        try:
+            while True:
+                if time.monotonic() - maintained > MAINTENANCE_INTERVAL:
+                    jobs.recover()
+                    jobs.prune()
+                    maintained = time.monotonic()
+                free = max(threads, 1) - len(running)
+                claimed = jobs.claim(free) if free else []
+                if pool is None:
+                    done += sum(jobs.run(job) for job in claimed)
+                else:
+                    running.update(pool.submit(work, job) for job in claimed)
+                if claimed:
+                    continue
+                if burst and not running:
+                    break
+                if running:
+                    finished, running = wait(
+                        running, settings.JOB_POLL_INTERVAL, FIRST_COMPLETED
+                    )
+                    done += sum(future.result() for future in finished)
+                else:
+                    time.sleep(settings.JOB_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+                done += sum(future.result() for future in running)
+        return done
+
+    def show_stats(self):
+        stats = jobs.stats()
+
+        def seconds(key):
+            value = stats[key]
+            return '-' if value is None else f'{value:.3f} с'
+        self.stdout.write(
+            f'В очереди: {stats["queued"]}, выполняются: {stats["running"]}, '
+            f'с ошибкой: {stats["failed"]}\n'
+            f'Самая старая готовая задача ждёт: {seconds("lag")}\n'
+            f'За час выполнено: {stats["finished"]}, ожидание в среднем '
+            f'{seconds("wait")} (до {seconds("wait_max")}), выполнение '
+            f'{seconds("run")} (до {seconds("run_max")})'
+        )
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.16 on 2026-10-18 09:40
+
+from django.db import migrations
+
+
+def drop_reset_mail_jobs(apps, schema_editor):
+    # Такие задачи хранили готовое письмо со ссылкой и токеном сброса
+    # пароля. Ждущие письма пропадут: сброс можно запросить снова.
+    Job = apps.get_model('core', 'Job')
+    Job.objects.filter(name='users.forms.send_email').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_reset_mail_jobs, migrations.RunPython.noop),
+    ]
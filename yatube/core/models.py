@@ -0,0 +1,86 @@
+from django.db import models
+from django.db.models import Q
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнено'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    name = models.CharField(
+        max_length=200,
+        verbose_name='Функция'
+    )
+    payload = models.TextField(
+        default='[]',
+        verbose_name='Аргументы (JSON)'
+    )
+    dedupe_key = models.CharField(
+        max_length=200,
+        null=True,
+        blank=True,
+        verbose_name='Ключ дедупликации'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+        verbose_name='Статус'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Попыток'
+    )
+    max_attempts = models.PositiveIntegerField(
+        verbose_name='Попыток не больше'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Поставлено'
+    )
+    run_at = models.DateTimeField(
+        verbose_name='Выполнить не раньше'
+    )
+    started = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Начато'
+    )
+    finished = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Закончено'
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Последняя ошибка'
+    )
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            # Выбор готовых задач воркером и подсчёт глубины очереди.
+            models.Index(
+                fields=['status', 'run_at'], name='core_job_status_run_at'
+            ),
+        ]
+        constraints = [
+            # Ждущая задача с ключом одна; выполняемая не мешает поставить
+            # новую, ведь данные могли измениться уже после её начала.
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=Q(status='queued'),
+                name='core_job_unique_queued_key',
+            ),
+        ]
@@ -1,6 +1,39 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
 from http import HTTPStatus
+from io import StringIO
 
-from django.test import TestCase, Client
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_decode
+
+from core import jobs
+from core.cache import TwoTierCache
+from core.models import Job
+from posts.models import Follow, Post, TimelineEntry
+
+User = get_user_model()
+
+CALLS = []
+
+
+def record(*args):
+    CALLS.append(args)
+
+
+def explode():
+    raise RuntimeError('boom')
 
 
 class ViewTestClass(TestCase):
@@ -14,3 +47,183 @@ class ViewTestClass(TestCase):
         response = self.client.get(non_page)
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(self.guest_client.get(non_page), template)
+
+
+@override_settings(JOB_QUEUE_INLINE=False)
+class JobQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        CALLS.clear()
+
+    def work(self):
+        out = StringIO()
+        call_command('run_workers', '--burst', '--threads', '0', stdout=out)
+        return out.getvalue()
+
+    def test_enqueue_dedupe_and_run(self):
+        """ JOBS | Задача выполняется воркером, ждущая задача с тем же
+        ключом не ставится второй раз """
+        self.assertIsNotNone(jobs.enqueue(record, 1, dedupe_key='k'))
+        self.assertIsNone(jobs.enqueue(record, 2, dedupe_key='k'))
+        jobs.enqueue(record, 3)
+        jobs.enqueue(record, 4, delay=60)
+        self.assertIn('Выполнено задач: 2', self.work())
+        self.assertEqual(CALLS, [(1,), (3,)])
+        stats = jobs.stats()
+        self.assertEqual((stats['done'], stats['queued']), (2, 1))
+        self.assertEqual(stats['finished'], 2)
+        self.assertGreaterEqual(stats['wait'], 0)
+        # Выполненная задача с ключом не мешает поставить новую.
+        self.assertIsNotNone(jobs.enqueue(record, 5, dedupe_key='k'))
+
+    def test_retry_with_backoff_then_fail(self):
+        """ JOBS | Упавшая задача повторяется позже с растущей задержкой,
+        после последней попытки остаётся с ошибкой """
+        job = jobs.enqueue(explode, max_attempts=2)
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('boom', job.last_error)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('с ошибкой: 1', self.stats())
+
+    def stats(self):
+        out = StringIO()
+        call_command('run_workers', '--stats', stdout=out)
+        return out.getvalue()
+
+    def test_lost_job_is_requeued(self):
+        """ JOBS | Задача пропавшего воркера возвращается в очередь """
+        job = jobs.enqueue(record, 1)
+        jobs.claim(1)
+        Job.objects.filter(pk=job.pk).update(
+            started=timezone.now() - timedelta(days=1)
+        )
+        jobs.recover()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_side_effects_are_queued(self):
+        """ JOBS | Письмо сброса пароля и раздача поста автора с большим
+        числом подписчиков уходят в очередь, а не выполняются в запросе """
+        author = User.objects.create_user(username='popular')
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        Follow.objects.create(user=reader, author=author)
+        for _ in range(2):
+            self.client.post(
+                reverse('users:password_reset'),
+                {'email': 'reader@example.com'},
+            )
+        with self.settings(TIMELINE_FANOUT_INLINE=0):
+            post = Post.objects.create(author=author, text='для всех')
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(TimelineEntry.objects.filter(user=reader).exists())
+        self.assertEqual(Job.objects.count(), 2)
+        self.work()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=reader, post=post).exists()
+        )
+
+    def test_password_reset_job_holds_no_token(self):
+        """ JOBS | В очереди сброса пароля нет ни токена, ни ссылки, а
+        письма пользователей с общим адресом не склеиваются """
+        users = [
+            User.objects.create_user(
+                username=f'twin{i}', email='twins@example.com',
+                password='pass',
+            )
+            for i in range(2)
+        ]
+        self.client.post(
+            reverse('users:password_reset'), {'email': 'twins@example.com'}
+        )
+        payloads = Job.objects.values_list('payload', flat=True)
+        self.assertEqual(
+            sorted(json.loads(payload)[0] for payload in payloads),
+            [user.pk for user in users],
+        )
+        for payload in payloads:
+            self.assertNotIn('/reset/', payload)
+            self.assertNotIn('twins@example.com', payload)
+        self.work()
+        self.assertEqual(len(mail.outbox), 2)
+        for message in mail.outbox:
+            uid, token = message.body.split('/reset/')[1].split('/')[:2]
+            user = User.objects.get(pk=urlsafe_base64_decode(uid).decode())
+            self.assertIn(user, users)
+            self.assertTrue(default_token_generator.check_token(user, token))
+
+
+class TwoTierCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.cache = TwoTierCache(
+            os.path.join(directory, 'cache.sqlite3'),
+            {'OPTIONS': {'RECHECK_INTERVAL': 0.05, 'L1_MAX_BYTES': 4096}},
+        )
+
+    def in_other_process(self, *calls):
+        """Выполняет (метод кэша, аргументы) в отдельном процессе."""
+        def target():
+            for name, *args in calls:
+                getattr(self.cache, name)(*args)
+        process = multiprocessing.get_context('fork').Process(target=target)
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+    def test_other_process_writes_are_seen_after_recheck(self):
+        """ CACHE | Запись и удаление в другом процессе видны после
+        сверки штампа, до неё значение отдаётся из L1 """
+        self.cache.set_many({'page': 'old', 'gone': 1, 'same': 'x'})
+        self.cache.set('version', 1, None)
+        self.in_other_process(
+            ('set', 'page', 'new'), ('delete', 'gone'), ('incr', 'version'),
+        )
+        self.assertEqual(self.cache.get('page'), 'old')
+        time.sleep(0.06)
+        self.assertEqual(
+            self.cache.get_many(['page', 'gone', 'same', 'version']),
+            {'page': 'new', 'same': 'x', 'version': 2},
+        )
+        counts = self.cache.stats()['process']
+        self.assertEqual(
+            (counts['l1_hits'], counts['rechecks'], counts['l2_hits'],
+             counts['misses']),
+            (1, 1, 2, 1),
+        )
+
+    def test_incr_add_and_expiry_across_processes(self):
+        """ CACHE | incr атомарен для всех процессов, add не перезаписывает
+        живую запись, истёкшие записи не отдаются """
+        self.cache.set('count', 0)
+        self.in_other_process(*[('incr', 'count')] * 20)
+        self.in_other_process(*[('incr', 'count')] * 20)
+        self.assertEqual(self.cache.incr('count'), 41)
+        self.assertFalse(self.cache.add('count', 0))
+        self.cache.set('short', 1, 0)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertTrue(self.cache.add('short', 2))
+        self.assertEqual(self.cache.get('short'), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_l1_is_bounded_and_stats_are_shared(self):
+        """ CACHE | L1 не растёт выше предела, вытесненное читается из L2;
+        счётчики других процессов видны в общей статистике """
+        for i in range(20):
+            self.cache.set(f'key{i}', 'x' * 300)
+        store = self.cache._store
+        self.assertLessEqual(store.l1.size, 4096)
+        self.assertEqual(self.cache.get('key0'), 'x' * 300)
+        self.in_other_process(('get', 'absent'), ('stats',))
+        self.assertGreaterEqual(self.cache.stats()['total']['misses'], 1)
@@ -1,17 +1,136 @@
-from django.contrib import admin
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.functional import cached_property
 
+from . import page_cache, search
 from .models import Post, Group, Comment, Follow
+from .utils import feed_count_key, group_choices
 
 
-class PostAdmin(admin.ModelAdmin):
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор админки без полного COUNT(*).
+
+    Строки считаются только до ADMIN_COUNT_LIMIT. Если их больше, для
+    таблицы без фильтров число оценивается по наибольшему id (удалённые
+    строки дают завышенную оценку), а для выборки с фильтром остаётся
+    равным пределу: дальше листать нужно, уточнив фильтр.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_COUNT_LIMIT
+        counted = self.object_list.order_by().values('pk')[:limit + 1].count()
+        if counted <= limit:
+            return counted
+        if self.object_list.query.where:
+            return limit
+        return self.object_list.aggregate(top=Max('pk'))['top']
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Иначе changelist считает ещё и всю таблицу без фильтров.
+    show_full_result_count = False
+
+
+class GroupFilter(admin.SimpleListFilter):
+    """Фильтр по группе со списком групп из кэша."""
+    title = 'группа'
+    parameter_name = 'group'
+
+    def lookups(self, request, model_admin):
+        return group_choices()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(group_id=self.value())
+        return queryset
+
+
+class MoveToGroupForm(ActionForm):
+    group = forms.TypedChoiceField(
+        label='Группа',
+        required=False,
+        coerce=int,
+        empty_value=None,
+        choices=lambda: [('', '- без группы -'), *group_choices()],
+    )
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group')
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
-    list_filter = ('pub_date',)
+    list_filter = ('pub_date', GroupFilter)
     empty_value_display = '-пусто-'
+    action_form = MoveToGroupForm
+    actions = ['move_to_group']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу FTS5 вместо LIKE '%...%' по всей таблице.
+        if not search_term or not search.available():
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        if not search.match_expression(search_term):
+            return queryset.none(), False
+        return search.filter_matching(queryset, search_term), False
+
+    def move_to_group(self, request, queryset):
+        try:
+            group_id = self.action_form.base_fields['group'].clean(
+                request.POST.get('group')
+            )
+        except ValidationError:
+            self.message_user(
+                request, 'Выберите группу из списка', messages.ERROR
+            )
+            return
+        # Одним UPDATE: сигналы не срабатывают, поэтому счётчики лент
+        # и версии страниц сбрасываются здесь.
+        rows = list(queryset.values_list('pk', 'group_id'))
+        updated = queryset.update(group_id=group_id, edited=timezone.now())
+        cache.delete_many([
+            feed_count_key('group', pk)
+            for pk in {group for _, group in rows} | {group_id} if pk
+        ])
+        # ETag API поста зависит только от его версии.
+        page_cache.bump(
+            'posts', 'groups', *(f'post:{pk}' for pk, _ in rows)
+        )
+        self.message_user(request, f'Перенесено постов: {updated}')
+    move_to_group.short_description = 'Перенести в группу'
+
+
+class GroupAdmin(admin.ModelAdmin):
+    list_display = ('title', 'slug')
+    search_fields = ('title', 'slug')
+
+
+class CommentAdmin(LargeTableAdmin):
+    list_display = ('pk', 'text', 'post', 'author', 'created')
+    list_select_related = ('post', 'author')
+    autocomplete_fields = ('post', 'author')
+    # По id, а не по created: для всей таблицы нужен только первичный ключ.
+    ordering = ('-pk',)
+
+
+class FollowAdmin(LargeTableAdmin):
+    list_display = ('pk', 'user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
 
 
 admin.site.register(Post, PostAdmin)
-admin.site.register(Group)
-admin.site.register(Comment)
-admin.site.register(Follow)
+admin.site.register(Group, GroupAdmin)
+admin.site.register(Comment, CommentAdmin)
+admin.site.register(Follow, FollowAdmin)
@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Post, UserStats
+
+User = get_user_model()
+
+
+def _shift(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def shift_user(user_id, field, delta):
+    """Сдвигает счётчик пользователя одним UPDATE с F().
+
+    Строки счётчиков может не быть у пользователя, созданного в обход
+    сигналов; при увеличении она создаётся пересчётом. Уменьшение без
+    строки пропускается: это удаление пользователя каскадом.
+    """
+    updated = _shift(UserStats.objects.filter(user_id=user_id), field, delta)
+    if not updated and delta > 0:
+        recount(User.objects.filter(pk=user_id))
+
+
+def shift_comments(post_id, delta):
+    _shift(Post.objects.filter(pk=post_id), 'comments_count', delta)
+
+
+def _count(model, field, outer_ref):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef(outer_ref)}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), Value(0))
+
+
+def recount(users=None):
+    """Пересчитывает счётчики пользователей одним UPDATE."""
+    users = User.objects.all() if users is None else users
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in users.values_list('pk', flat=True)],
+        ignore_conflicts=True,
+    )
+    return UserStats.objects.filter(user__in=users.values('pk')).update(
+        posts_count=_count(Post, 'author', 'user_id'),
+        followers_count=_count(Follow, 'author', 'user_id'),
+        following_count=_count(Follow, 'user', 'user_id'),
+    )
+
+
+def recount_comments(posts=None):
+    posts = Post.objects.all() if posts is None else posts
+    return posts.update(comments_count=_count(Comment, 'post', 'pk'))
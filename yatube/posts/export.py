@@ -0,0 +1,146 @@
+"""Потоковая выгрузка постов и комментариев в NDJSON и CSV.
+
+Посты читаются пачками по `EXPORT_CHUNK_SIZE` строк по ключу id, по
+одному короткому запросу на пачку, комментарии - одним запросом на
+пачку постов. Генераторы отдают готовые строки, поэтому команда и view
+пишут их сразу, а память не растёт с размером таблицы.
+"""
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Comment, Post
+from .serializers import POST_API_FIELDS
+
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_FIELDS = [
+    'id', 'author', 'group', 'pub_date', 'text', 'image', 'comments_count'
+]
+COMMENT_FIELDS = {
+    'id': 'id',
+    'post': 'post_id',
+    'author': 'author__username',
+    'created': 'created',
+    'text': 'text',
+}
+CSV_COLUMNS = ['kind', 'id', 'post', 'author', 'group', 'date', 'text',
+               'image', 'comments_count']
+
+
+def parse_moment(value, name):
+    """Дата или дата-время ISO 8601; ValueError с понятным текстом."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'{name} must be an ISO 8601 date or datetime')
+        moment = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(author=None, group=None, since=None, until=None):
+    """Посты для выгрузки: автор, группа и полуинтервал [since, until)."""
+    posts = Post.objects.all()
+    if author:
+        posts = posts.filter(author__username=author)
+    if group:
+        posts = posts.filter(group__slug=group)
+    if since:
+        posts = posts.filter(pub_date__gte=parse_moment(since, 'since'))
+    if until:
+        posts = posts.filter(pub_date__lt=parse_moment(until, 'until'))
+    return posts.values(*[POST_API_FIELDS[name] for name in EXPORT_FIELDS])
+
+
+def _chunks(queryset, chunk_size):
+    last_id = 0
+    while True:
+        chunk = list(
+            queryset.filter(id__gt=last_id).order_by('id')[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]['id']
+
+
+def _comments_of(post_ids):
+    comments = {}
+    rows = Comment.objects.filter(post_id__in=post_ids).order_by(
+        'post_id', 'created', 'id'
+    ).values(*COMMENT_FIELDS.values())
+    for row in rows:
+        comments.setdefault(row['post_id'], []).append({
+            name: row[path] for name, path in COMMENT_FIELDS.items()
+        })
+    return comments
+
+
+def iter_posts(queryset, with_comments=False, chunk_size=None):
+    """Посты словарями; с `with_comments` у каждого есть `comments`."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    for chunk in _chunks(queryset, chunk_size):
+        if with_comments:
+            comments = _comments_of([row['id'] for row in chunk])
+        for row in chunk:
+            post = {
+                name: row[POST_API_FIELDS[name]] for name in EXPORT_FIELDS
+            }
+            post['image'] = post['image'] or None
+            if with_comments:
+                post['comments'] = comments.get(post['id'], [])
+            yield post
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def ndjson_lines(posts):
+    for post in posts:
+        yield json.dumps(
+            post, ensure_ascii=False, default=_json_default
+        ) + '\n'
+
+
+class _Echo:
+    """Буфер для csv.writer, который просто возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(posts):
+    """Одна строка на пост и по строке на каждый его комментарий."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for post in posts:
+        yield writer.writerow([
+            'post', post['id'], '', post['author'], post['group'] or '',
+            post['pub_date'].isoformat(), post['text'], post['image'] or '',
+            post['comments_count'],
+        ])
+        for comment in post.get('comments', ()):
+            yield writer.writerow([
+                'comment', comment['id'], comment['post'], comment['author'],
+                '', comment['created'].isoformat(), comment['text'], '', '',
+            ])
+
+
+def export_lines(fmt, queryset, with_comments=False, chunk_size=None):
+    posts = iter_posts(queryset, with_comments, chunk_size)
+    if fmt == 'csv':
+        return csv_lines(posts)
+    return ndjson_lines(posts)
@@ -0,0 +1,287 @@
+"""Массовая загрузка постов, комментариев и подписок из JSONL.
+
+Одна строка - одна запись, поле `type` выбирает вид (по умолчанию
+"post"):
+
+    {"id": 7, "author": "leo", "group": "cats", "text": "...",
+     "pub_date": "2022-08-31T20:41:00+00:00", "image": "posts/a.jpg",
+     "comments": [{"author": "ann", "text": "...", "created": "..."}]}
+    {"type": "comment", "post": 7, "author": "ann", "text": "..."}
+    {"type": "follow", "user": "ann", "author": "leo"}
+
+Это же формат, который пишет `export_posts --comments`. Имена и slug
+разрешаются через словари в памяти, первичные ключи выдаются заранее,
+так что ссылки на посты разрешаются без обращения к базе. Записи
+пишутся executemany по IMPORT_CHUNK_SIZE штук в транзакции, сигналы
+не вызываются, а счётчики, ленты и кэши пересобираются в `finish()`.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import counters, page_cache, timeline
+from .models import Comment, Follow, Group, Post
+from .utils import feed_count_key
+
+User = get_user_model()
+
+POST_COLUMNS = ['id', 'author', 'group', 'text', 'pub_date', 'edited',
+                'image', 'image_placeholder', 'comments_count']
+COMMENT_COLUMNS = ['post', 'author', 'text', 'created']
+FOLLOW_COLUMNS = ['user', 'author']
+
+
+class SkipRecord(ValueError):
+    """Запись пропущена: неизвестный автор, группа, пост или дата."""
+
+
+def _next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def _moment(value):
+    """Дата записи, уже приведённая к виду, в котором её хранит база."""
+    if not value:
+        moment = timezone.now()
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise SkipRecord(f'bad datetime {value!r}')
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+    return connection.ops.adapt_datetimefield_value(moment)
+
+
+def insert_rows(model, fields, rows, ignore_conflicts=False):
+    """Вставляет готовые кортежи одним executemany.
+
+    В отличие от bulk_create здесь нет экземпляров моделей, pre_save
+    и подготовки каждого значения компилятором запроса, поэтому
+    auto_now_add не перетирает даты из файла, а вставка в несколько
+    раз быстрее. Значения должны быть уже адаптированы для базы.
+    """
+    ops, opts = connection.ops, model._meta
+    columns = [opts.get_field(name).column for name in fields]
+    sql = '{} {} ({}) VALUES ({}) {}'.format(
+        ops.insert_statement(ignore_conflicts=ignore_conflicts),
+        ops.quote_name(opts.db_table),
+        ', '.join(map(ops.quote_name, columns)),
+        ', '.join(['%s'] * len(columns)),
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=ignore_conflicts),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+class Importer:
+    def __init__(self, keep_ids=False, create_missing=False):
+        self.keep_ids = keep_ids
+        self.create_missing = create_missing
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        self.next_post = _next_pk(Post)
+        self.next_user = _next_pk(User)
+        self.next_group = _next_pk(Group)
+        # Исходный id поста -> pk в базе, для ссылок из комментариев.
+        self.post_ids = {}
+        self.authors = set()
+        self.group_ids = set()
+        self.followers = set()
+        self.commented = set()
+        self.counts = dict.fromkeys(
+            ['posts', 'comments', 'follows', 'users', 'groups', 'skipped'],
+            0,
+        )
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self.new_users = []
+        self.new_groups = []
+        self.posts = []
+        self.comments = []
+        self.follows = []
+
+    # Разрешение ссылок
+
+    def user_id(self, username):
+        if username in self.users:
+            return self.users[username]
+        if not username or not self.create_missing:
+            raise SkipRecord(f'unknown user {username!r}')
+        user = User(pk=self.next_user, username=username)
+        user.set_unusable_password()
+        self.new_users.append(user)
+        self.users[username] = self.next_user
+        self.next_user += 1
+        return user.pk
+
+    def group_id(self, slug):
+        if not slug:
+            return None
+        if slug in self.groups:
+            return self.groups[slug]
+        if not self.create_missing:
+            raise SkipRecord(f'unknown group {slug!r}')
+        self.new_groups.append(
+            Group(pk=self.next_group, slug=slug, title=slug, description='')
+        )
+        self.groups[slug] = self.next_group
+        self.next_group += 1
+        return self.groups[slug]
+
+    def post_id(self, source_id):
+        if source_id in self.post_ids:
+            return self.post_ids[source_id]
+        if self.keep_ids and isinstance(source_id, int):
+            return source_id
+        raise SkipRecord(f'unknown post {source_id!r}')
+
+    # Разбор записей
+
+    def add(self, line):
+        """Разбирает строку JSONL в буферы; False, если строка пропущена.
+
+        Пропущенная запись не оставляет после себя ничего: авторы и
+        группы, созданные для неё до ошибки, убираются вместе с ней.
+        """
+        created = len(self.new_users), len(self.new_groups)
+        try:
+            record = json.loads(line)
+            kind = record.get('type', 'post')
+            if kind == 'post':
+                self.add_post(record)
+            elif kind == 'comment':
+                post_id = self.post_id(record.get('post'))
+                self.comments.append(self.comment(record, post_id))
+                if record['post'] not in self.post_ids:
+                    self.commented.add(post_id)
+            elif kind == 'follow':
+                self.add_follow(record)
+            else:
+                raise SkipRecord(f'unknown type {kind!r}')
+        except (ValueError, AttributeError, KeyError, TypeError):
+            self._forget(*created)
+            self.counts['skipped'] += 1
+            return False
+        return True
+
+    def _forget(self, users, groups):
+        for user in self.new_users[users:]:
+            del self.users[user.username]
+            self.next_user = min(self.next_user, user.pk)
+        for group in self.new_groups[groups:]:
+            del self.groups[group.slug]
+            self.next_group = min(self.next_group, group.pk)
+        del self.new_users[users:]
+        del self.new_groups[groups:]
+
+    def add_post(self, record):
+        author_id = self.user_id(record['author'])
+        group_id = self.group_id(record.get('group'))
+        pub_date = _moment(record.get('pub_date'))
+        text = str(record['text'])
+        pk = self.next_post
+        if self.keep_ids and record.get('id'):
+            pk = record['id']
+        next_post = max(self.next_post, pk + 1)
+        comments = [
+            self.comment(comment, pk) for comment in record.get('comments', ())
+        ]
+        # Дальше ошибок нет: ссылки на пост и его pk запоминаются, только
+        # когда вся запись разобрана.
+        if record.get('id') is not None:
+            self.post_ids[record['id']] = pk
+        self.next_post = next_post
+        self.posts.append((
+            pk, author_id, group_id, text, pub_date, pub_date,
+            record.get('image') or '', '', len(comments),
+        ))
+        self.authors.add(author_id)
+        if group_id:
+            self.group_ids.add(group_id)
+        self.comments.extend(comments)
+
+    def comment(self, record, post_id):
+        return (
+            post_id, self.user_id(record['author']), str(record['text']),
+            _moment(record.get('created')),
+        )
+
+    def add_follow(self, record):
+        user_id = self.user_id(record['user'])
+        author_id = self.user_id(record['author'])
+        if user_id == author_id:
+            raise SkipRecord('self-follow')
+        self.follows.append((user_id, author_id))
+        self.followers.add(user_id)
+        self.authors.add(author_id)
+
+    # Запись
+
+    @property
+    def pending(self):
+        return len(self.posts) + len(self.comments) + len(self.follows)
+
+    def flush(self):
+        """Пишет накопленные записи одной транзакцией."""
+        with transaction.atomic():
+            User.objects.bulk_create(self.new_users)
+            Group.objects.bulk_create(self.new_groups)
+            insert_rows(Post, POST_COLUMNS, self.posts)
+            insert_rows(Comment, COMMENT_COLUMNS, self.comments)
+            insert_rows(
+                Follow, FOLLOW_COLUMNS, self.follows, ignore_conflicts=True
+            )
+        self.counts['users'] += len(self.new_users)
+        self.counts['groups'] += len(self.new_groups)
+        self.counts['posts'] += len(self.posts)
+        self.counts['comments'] += len(self.comments)
+        self.counts['follows'] += len(self.follows)
+        self._reset_buffers()
+
+    def finish(self):
+        """Пересобирает всё, что сигналы поддерживают для единичных записей.
+
+        Счётчики пересчитываются целиком двумя UPDATE, ленты - только
+        у подписчиков затронутых авторов, кэши страниц и размеров лент
+        сбрасываются по затронутым областям.
+        """
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, Group, Post, Comment, Follow]
+            ):
+                cursor.execute(sql)
+        counters.recount()
+        counters.recount_comments()
+        timeline.reclassify()
+        readers = set(self.followers)
+        authors = list(self.authors)
+        for start in range(0, len(authors), 500):
+            readers.update(Follow.objects.filter(
+                author_id__in=authors[start:start + 500]
+            ).values_list('user_id', flat=True))
+        for user_id in readers:
+            with transaction.atomic():
+                timeline.rebuild(user_id)
+
+        names = {pk: name for name, pk in self.users.items()}
+        slugs = {pk: slug for slug, pk in self.groups.items()}
+        cache.delete_many([
+            feed_count_key('index'),
+            *(feed_count_key('author', pk) for pk in self.authors),
+            *(feed_count_key('group', pk) for pk in self.group_ids),
+        ])
+        page_cache.bump(
+            'posts',
+            *(['groups'] if self.counts['groups'] else []),
+            *(f'profile:{names[pk]}' for pk in self.authors | readers),
+            *(f'group:{slugs[pk]}' for pk in self.group_ids),
+            *(f'post:{pk}' for pk in self.commented),
+        )
+        return len(readers)
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+EMPTY_VALUE = cached_db_kvstore.EMPTY_VALUE
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """KVStore sorl с LRU в памяти процесса и пакетным чтением.
+
+    Найденные записи живут в LRU до THUMBNAIL_LRU_TIMEOUT секунд, так
+    что повторные страницы не ходят ни в кэш, ни в базу. Промахи не
+    запоминаются ни в LRU, ни в кэше (sorl кэширует их на
+    THUMBNAIL_CACHE_TIMEOUT): миниатюру создаёт фоновая задача в другом
+    процессе, и страница, пересобранная после неё, должна её увидеть.
+    Промах стоит запроса к базе, но только пока миниатюры нет.
+    `get_many` читает записи всей страницы одним get_many кэша и одним
+    запросом к базе.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lru_get(self, key):
+        with self._lock:
+            item = self._lru.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return value
+
+    def _remember(self, key, value):
+        expires = time.monotonic() + settings.THUMBNAIL_LRU_TIMEOUT
+        with self._lock:
+            self._lru[key] = (value, expires)
+            self._lru.move_to_end(key)
+            while len(self._lru) > settings.THUMBNAIL_LRU_SIZE:
+                self._lru.popitem(last=False)
+
+    def _get_raw(self, key):
+        return self.get_many_raw([key]).get(key)
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self._remember(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+
+    def get_many_raw(self, keys):
+        """Сырые значения по ключам; отсутствующих ключей нет в ответе."""
+        values = {}
+        missing = []
+        for key in keys:
+            value = self._lru_get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                values[key] = value
+        if missing:
+            cached = self.cache.get_many(missing)
+            missing = [key for key in missing if key not in cached]
+            stored = dict(KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list('key', 'value')) if missing else {}
+            if stored:
+                self.cache.set_many(
+                    stored, sorl_settings.THUMBNAIL_CACHE_TIMEOUT
+                )
+            cached.update(stored)
+            for key, value in cached.items():
+                # Промахи, закэшированные стандартным KVStore sorl.
+                if value != EMPTY_VALUE:
+                    values[key] = value
+                    self._remember(key, value)
+        return values
+
+    def get_many(self, image_files):
+        """Записи image-файлов по их `key`; ненайденных нет в ответе."""
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        return {
+            keys[raw_key]: deserialize_image_file(value)
+            for raw_key, value in self.get_many_raw(keys).items()
+        }
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+# Модели и sorl импортируются внутри функций: при запуске процессов
+# методом spawn модуль загружается в дочернем процессе до django.setup().
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _build(task):
+    """Миниатюры одной картинки в процессе пула.
+
+    Возвращает (число созданных, размеры и placeholder, ошибка); размеры
+    считаются, только если их у поста ещё нет.
+    """
+    from posts.thumbnails import image_meta, rebuild
+    name, force, need_meta = task
+    try:
+        built = rebuild(name, force)
+        return built, image_meta(name) if need_meta else None, None
+    except Exception as error:
+        return None, None, f'{name}: {error!r}'
+
+
+def _signature(force):
+    from posts.thumbnails import enabled_thumbnails
+    geometries = json.dumps(enabled_thumbnails(), sort_keys=True)
+    return hashlib.md5(f'{geometries}|{force}'.encode()).hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересоздаёт миниатюры картинок всех постов в пуле процессов '
+        'и досчитывает их размеры и placeholder. '
+        'Актуальные миниатюры пропускаются, прогресс сохраняется в файл, '
+        'и прерванный запуск продолжается с того же места.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Процессов в пуле; 0 - в этом процессе.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true',
+                            help='Пересоздать и актуальные миниатюры.')
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR, '.thumbnails.json'),
+            help='Файл с id последнего обработанного поста.',
+        )
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать сначала, не читая checkpoint.')
+
+    def load_checkpoint(self, path, signature):
+        # Checkpoint от другого набора геометрий не подходит.
+        try:
+            with open(path) as source:
+                state = json.load(source)
+        except (OSError, ValueError):
+            return 0
+        return state['last_id'] if state.get('signature') == signature else 0
+
+    def process(self, mapper, chunk, force, tally):
+        """Обрабатывает пачку постов; возвращает области кэша страниц."""
+        from posts.models import Post
+
+        results = mapper(_build, [
+            (image, force, force or not placeholder)
+            for _, image, _, _, placeholder in chunk
+        ])
+        scopes = set()
+        for (pk, _, username, slug, _), (built, meta, error) in zip(
+            chunk, results
+        ):
+            if error:
+                tally['failed'] += 1
+                self.stderr.write(error)
+                continue
+            tally['built' if built else 'skipped'] += 1
+            if meta:
+                width, height, placeholder = meta
+                Post.objects.filter(pk=pk).update(
+                    image_width=width, image_height=height,
+                    image_placeholder=placeholder,
+                )
+            if built or meta:
+                scopes.update([f'post:{pk}', f'profile:{username}'])
+                if slug:
+                    scopes.add(f'group:{slug}')
+        tally['images'] += len(chunk)
+        return scopes
+
+    def handle(self, *args, **options):
+        from posts import page_cache
+        from posts.models import Post
+
+        force, path = options['force'], options['checkpoint']
+        signature = _signature(force)
+        last_id = (
+            0 if options['restart']
+            else self.load_checkpoint(path, signature)
+        )
+        if last_id:
+            self.stdout.write(f'Продолжаем после поста {last_id}')
+        posts = Post.objects.exclude(image='').order_by('id')
+        total = posts.filter(id__gt=last_id).count()
+        tally = dict.fromkeys(['images', 'built', 'skipped', 'failed'], 0)
+        started = time.monotonic()
+        workers = options['workers']
+        pool = None
+        if workers:
+            # Дочерние процессы не должны унаследовать открытые соединения.
+            connections.close_all()
+            pool = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker
+            )
+        try:
+            while True:
+                chunk = list(posts.filter(id__gt=last_id).values_list(
+                    'id', 'image', 'author__username', 'group__slug',
+                    'image_placeholder',
+                )[:options['chunk_size']])
+                if not chunk:
+                    break
+                mapper = map if pool is None else partial(
+                    pool.map, chunksize=max(1, len(chunk) // workers // 4)
+                )
+                scopes = self.process(mapper, chunk, force, tally)
+                if scopes:
+                    page_cache.bump('posts', *scopes)
+                last_id = chunk[-1][0]
+                with open(path, 'w') as target:
+                    json.dump(
+                        {'last_id': last_id, 'signature': signature}, target
+                    )
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{tally["images"]}/{total}: '
+                    f'{tally["images"] / elapsed:.1f} картинок/с'
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if os.path.exists(path):
+            os.remove(path)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {elapsed:.1f} с: создано {tally["built"]}, '
+            f'актуальных {tally["skipped"]}, ошибок {tally["failed"]}; '
+            f'{tally["images"] / max(elapsed, 1e-9):.1f} картинок/с'
+        ))
@@ -0,0 +1,102 @@
+import inspect
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.views.decorators.cache import cache_page
+
+from posts import views
+from posts.page_cache import protected_cache_page
+
+MODES = {
+    'cache_page': cache_page,
+    'protected': protected_cache_page,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест кэша страниц: потоки без пауз запрашивают '
+        'главную, а её копия в кэше истекает каждые --ttl секунд. Для '
+        'cache_page и защищённого кэша выводится, сколько раз страница '
+        'собиралась и сколько запросов к БД пришлось на интервалы '
+        '--bucket: без защиты на каждом истечении в БД идут все потоки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Секунд на каждый режим.')
+        parser.add_argument('--ttl', type=int, default=2,
+                            help='Срок страницы в кэше, секунд.')
+        parser.add_argument('--bucket', type=float, default=0.1,
+                            help='Интервал подсчёта запросов к БД, секунд.')
+
+    def handle(self, *args, **options):
+        view = inspect.unwrap(views.index)
+        for mode, decorator in MODES.items():
+            cache.clear()
+            renders = []
+
+            def counted(request):
+                renders.append(1)
+                return view(request)
+            cached_view = decorator(
+                options['ttl'], key_prefix=f'bench.{mode}'
+            )(counted)
+            served, queries = self.load(cached_view, options)
+            self.report(mode, served, len(renders), queries, options)
+
+    def load(self, cached_view, options):
+        """Гоняет cached_view из потоков; возвращает число ответов и
+        время каждого запроса к БД от начала замера.
+        """
+        factory = RequestFactory()
+        served, queries = [], []
+        started = time.monotonic()
+        stop = started + options['duration']
+
+        def count(execute, sql, params, many, context):
+            queries.append(time.monotonic() - started)
+            return execute(sql, params, many, context)
+
+        def client():
+            with connection.execute_wrapper(count):
+                while time.monotonic() < stop:
+                    request = factory.get('/')
+                    request.user = AnonymousUser()
+                    cached_view(request)
+                    served.append(1)
+            connection.close()
+        threads = [
+            threading.Thread(target=client)
+            for _ in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(served), queries
+
+    def report(self, mode, served, renders, queries, options):
+        buckets = Counter(int(moment // options['bucket'])
+                          for moment in queries)
+        per_bucket = [
+            buckets.get(i, 0)
+            for i in range(int(options['duration'] / options['bucket']))
+        ]
+        expirations = max(1, int(options['duration'] // options['ttl']))
+        self.stdout.write(
+            f'{mode:>10}: ответов {served}, сборок {renders} '
+            f'({renders / expirations:.1f} на истечение), '
+            f'запросов к БД {len(queries)}; на интервал '
+            f'{options["bucket"]} с: медиана '
+            f'{statistics.median(per_bucket or [0]):.0f}, '
+            f'максимум {max(per_bucket or [0])}'
+        )
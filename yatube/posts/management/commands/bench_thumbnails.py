@@ -0,0 +1,117 @@
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from PIL import Image
+from sorl.thumbnail.helpers import get_module_class
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.parsers import parse_geometry
+
+from posts.thumbnails import backend, enabled_thumbnails
+
+ENGINES = {
+    'sorl': 'sorl.thumbnail.engines.pil_engine.Engine',
+    'draft': 'posts.thumbnail_engine.Engine',
+}
+EXIF_ORIENTATION = 0x0112
+
+
+def make_corpus(path, count, size, seed):
+    """Большие JPEG, похожие на фото с телефона, часть - повёрнутые."""
+    rng = random.Random(seed)
+    for i in range(count):
+        base = Image.linear_gradient('L').resize(size)
+        noise = Image.effect_noise(size, rng.randint(20, 60))
+        image = Image.merge('RGB', (base, noise, base.rotate(180)))
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = rng.choice([1, 1, 3, 6, 8])
+        image.save(
+            os.path.join(path, f'photo{i}.jpg'), quality=90, exif=exif
+        )
+
+
+def run_engine(engine_path, corpus):
+    """Создаёт миниатюры всего корпуса движком, меряет время каждой."""
+    engine = get_module_class(engine_path)()
+    storage = FileSystemStorage(location=corpus)
+    samples = []
+    for name in sorted(os.listdir(corpus)):
+        for geometry_string, options in enabled_thumbnails().values():
+            source = ImageFile(name, storage)
+            options = backend.full_options(source, options)
+            started = time.perf_counter()
+            image = engine.get_image(source)
+            ratio = engine.get_image_ratio(image, options)
+            geometry = parse_geometry(geometry_string, ratio)
+            thumbnail = engine.create(image, geometry, options)
+            engine._get_raw_data(
+                thumbnail, options['format'], options['quality'],
+                image_info={}
+            )
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает движки миниатюр на корпусе больших JPEG: задержка '
+        'на картинку и пиковая память (RSS). Каждый движок запускается '
+        'в отдельном процессе, чтобы пики памяти не смешивались.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus',
+                            help='Каталог с JPEG; без него создаётся '
+                                 'временный синтетический корпус.')
+        parser.add_argument('--images', type=int, default=8)
+        parser.add_argument('--size', default='6000x4000',
+                            help='Размер синтетических картинок.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--engine', choices=ENGINES,
+                            help='Внутренний режим: замер одного движка.')
+
+    def handle(self, *args, **options):
+        if options['engine']:
+            samples = run_engine(ENGINES[options['engine']],
+                                 options['corpus'])
+            self.stdout.write(json.dumps({
+                'samples': samples,
+                # ru_maxrss в Linux в килобайтах.
+                'maxrss': resource.getrusage(
+                    resource.RUSAGE_SELF
+                ).ru_maxrss,
+            }))
+            return
+        with tempfile.TemporaryDirectory() as tmp:
+            corpus = options['corpus']
+            if not corpus:
+                corpus = tmp
+                size = tuple(map(int, options['size'].split('x')))
+                self.stdout.write(
+                    f'Создаём {options["images"]} картинок {options["size"]}'
+                )
+                make_corpus(corpus, options['images'], size, options['seed'])
+            for engine in ENGINES:
+                result = json.loads(subprocess.run(
+                    [sys.executable,
+                     os.path.join(settings.BASE_DIR, 'manage.py'),
+                     'bench_thumbnails',
+                     '--engine', engine, '--corpus', corpus],
+                    check=True, capture_output=True, text=True,
+                ).stdout)
+                samples = sorted(result['samples'])
+                p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+                self.stdout.write(
+                    f'{engine:6} p50 {statistics.median(samples) * 1000:7.1f}'
+                    f' ms  p95 {p95 * 1000:7.1f} ms  '
+                    f'peak RSS {result["maxrss"] / 1024:7.1f} MB'
+                )
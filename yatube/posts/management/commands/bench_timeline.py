@@ -0,0 +1,113 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from posts import counters, timeline
+from posts.models import Follow, Post
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+def ms(samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if samples else 0
+    return (
+        f'p50 {statistics.median(samples) * 1000:7.2f} ms  '
+        f'p95 {p95 * 1000:7.2f} ms  max {samples[-1] * 1000:7.2f} ms'
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет post_create и чтение ленты подписок на графе подписок '
+        'с распределением Ципфа: чистый fan-out против гибридной ленты. '
+        'Все данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок на одного читателя.')
+        parser.add_argument('--posts', type=int, default=100,
+                            help='Сколько постов создать в каждом режиме.')
+        parser.add_argument('--reads', type=int, default=200)
+        parser.add_argument('--threshold', type=int, default=500,
+                            help='Порог подписчиков для гибридного режима.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            # Кэш общий и не откатывается вместе с базой.
+            cache.delete(timeline.CELEBRITIES_KEY)
+
+    def run(self, options):
+        rnd = random.Random(options['seed'])
+        User.objects.bulk_create([
+            User(username=f'bench_{i}') for i in range(options['users'])
+        ])
+        users = list(User.objects.filter(
+            username__startswith='bench_'
+        ).order_by('id').values_list('id', flat=True))
+        authors = users[:options['authors']]
+        weights = [1 / rank for rank in range(1, len(authors) + 1)]
+        follows = set()
+        for reader in users[options['authors']:]:
+            chosen = rnd.choices(authors, weights, k=options['follows'])
+            follows.update((reader, author) for author in chosen)
+        Follow.objects.bulk_create(
+            [Follow(user_id=u, author_id=a) for u, a in follows]
+        )
+        counters.recount(
+            User.objects.filter(username__startswith='bench_')
+        )
+        followers = {a: 0 for a in authors}
+        for _, author in follows:
+            followers[author] += 1
+        self.stdout.write(
+            f'{len(users)} users, {len(follows)} follows, '
+            f'top author has {max(followers.values())} followers'
+        )
+        readers = rnd.sample(users[options['authors']:], options['reads'])
+        modes = [
+            ('push', len(users) + 1),
+            ('hybrid', options['threshold']),
+        ]
+        for mode, threshold in modes:
+            # Раздача в самом запросе: сравнивается её полная цена.
+            with override_settings(TIMELINE_CELEBRITY_FOLLOWERS=threshold,
+                                   TIMELINE_FANOUT_INLINE=len(users)):
+                timeline.reclassify(authors)
+                self.measure(mode, rnd, authors, weights, readers, options)
+
+    def measure(self, mode, rnd, authors, weights, readers, options):
+        writes = []
+        for i in range(options['posts']):
+            author_id = rnd.choices(authors, weights)[0]
+            started = time.perf_counter()
+            Post.objects.create(author_id=author_id, text=f'{mode} {i}')
+            writes.append(time.perf_counter() - started)
+        factory = RequestFactory()
+        reads = []
+        for user in User.objects.filter(id__in=readers):
+            started = time.perf_counter()
+            list(timeline.follow_feed(user, factory.get('/follow/')))
+            reads.append(time.perf_counter() - started)
+        self.stdout.write(f'{mode:>6} post_create: {ms(writes)}')
+        self.stdout.write(f'{mode:>6} follow feed: {ms(reads)}')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.export import FORMATS, export_lines, export_queryset
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает посты (и, по желанию, комментарии) в NDJSON или CSV '
+        'потоком: строки пишутся по мере чтения пачек из базы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--comments', action='store_true',
+                            help='Добавить комментарии к каждому посту.')
+        parser.add_argument('--author', help='Username автора.')
+        parser.add_argument('--group', help='Slug группы.')
+        parser.add_argument('--since', help='Не раньше этой даты, ISO 8601.')
+        parser.add_argument('--until', help='Раньше этой даты, ISO 8601.')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--output', '-o',
+                            help='Файл для выгрузки, по умолчанию stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            posts = export_queryset(
+                options['author'], options['group'],
+                options['since'], options['until'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        lines = export_lines(
+            options['format'], posts, options['comments'],
+            options['chunk_size'],
+        )
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as output:
+            output.writelines(lines)
@@ -0,0 +1,125 @@
+import os
+import shutil
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from posts.models import Post
+
+
+def scan(root, prefix):
+    """Файлы под root/prefix: пары (имя в хранилище, os.DirEntry).
+
+    Обход идёт os.scandir без рекурсии и без списка всех файлов, так что
+    память не растёт с размером каталога.
+    """
+    stack = [os.path.join(root, prefix)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    name = os.path.relpath(entry.path, root)
+                    yield name.replace(os.sep, '/'), entry
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def referenced_images(names):
+    return set(Post.objects.filter(
+        image__in=names
+    ).values_list('image', flat=True))
+
+
+def referenced_thumbnails(names):
+    keys = {
+        add_prefix(ImageFile(name, default.storage).key): name
+        for name in names
+    }
+    return {keys[key] for key in default.kvstore.get_many_raw(keys)}
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT картинки, на которые не ссылается ни один '
+        'пост, вместе с их миниатюрами и записями sorl, а также файлы '
+        'миниатюр без записей в key-value хранилище. Каталоги читаются '
+        'потоком, ссылки проверяются пачками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument(
+            '--min-age', type=float, default=24,
+            help='Не трогать файлы моложе стольких часов: загрузка могла '
+                 'ещё не дойти до коммита поста.',
+        )
+        parser.add_argument('--quarantine',
+                            help='Переносить файлы в этот каталог, '
+                                 'а не удалять.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что было бы удалено.')
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        cutoff = time.time() - options['min_age'] * 3600
+        self.options = options
+        self.tally = dict.fromkeys(['files', 'orphans', 'young', 'bytes'], 0)
+        # Сначала картинки: удаляя их записи sorl, удаляем и миниатюры.
+        trees = [
+            ('posts', referenced_images, True),
+            (sorl_settings.THUMBNAIL_PREFIX, referenced_thumbnails, False),
+        ]
+        for prefix, referenced, is_source in trees:
+            for chunk in chunks(scan(root, prefix), options['chunk_size']):
+                self.tally['files'] += len(chunk)
+                alive = referenced([name for name, _ in chunk])
+                for name, entry in chunk:
+                    if name in alive:
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime > cutoff:
+                        self.tally['young'] += 1
+                        continue
+                    self.collect(name, entry.path, is_source)
+                    self.tally['orphans'] += 1
+                    self.tally['bytes'] += stat.st_size
+        verb = 'Нашли бы' if options['dry_run'] else 'Убрано'
+        self.stdout.write(self.style.SUCCESS(
+            f'Просмотрено файлов: {self.tally["files"]}. {verb} '
+            f'{self.tally["orphans"]} ({filesizeformat(self.tally["bytes"])}),'
+            f' оставлено свежих: {self.tally["young"]}'
+        ))
+
+    def collect(self, name, path, is_source):
+        """Удаляет или переносит в карантин файл без ссылок."""
+        if self.options['dry_run']:
+            self.stdout.write(name)
+            return
+        if is_source:
+            default.kvstore.delete(ImageFile(name, default.storage))
+        if self.options['quarantine']:
+            target = os.path.join(self.options['quarantine'], name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        else:
+            os.remove(path)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters, timeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает денормализованные счётчики: посты, подписчиков и '
+        'подписки пользователей, комментарии постов. Затем заново '
+        'определяет авторов, чьи посты подмешиваются в ленты при чтении.'
+    )
+
+    def handle(self, *args, **options):
+        users = counters.recount()
+        posts = counters.recount_comments()
+        timeline.reclassify()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано пользователей: {users}, постов: {posts}'
+        ))
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:47
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_edited(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(edited=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='edited',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(fill_edited, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:30
+
+from django.db import migrations
+
+from posts import search
+
+
+def create_index(apps, schema_editor):
+    search.install(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_content_addressed_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
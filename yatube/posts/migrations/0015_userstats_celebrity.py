@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 09:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_celebrities(apps, schema_editor):
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.filter(
+        followers_count__gte=settings.TIMELINE_CELEBRITY_FOLLOWERS
+    ).update(celebrity=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='celebrity',
+            field=models.BooleanField(default=False, help_text='Посты не раздаются подписчикам, см. posts.timeline', verbose_name='Посты читаются из ленты автора'),
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
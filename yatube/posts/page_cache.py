@@ -0,0 +1,299 @@
+import hashlib
+import math
+import random
+import time
+from collections import namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.cache import CacheMiddleware
+from django.utils.cache import (get_cache_key, get_max_age, has_vary_header,
+                                learn_cache_key, patch_response_headers,
+                                patch_vary_headers)
+from django.utils.decorators import decorator_from_middleware_with_args
+from django.views.decorators.http import condition
+
+from .models import Group, Post
+
+
+def _version_key(scope):
+    return f'page_version:{scope}'
+
+
+def _new_version():
+    # Версия из времени, а не 1: после вытеснения ключа из кэша
+    # старые страницы не совпадут с новой версией случайно.
+    return time.time_ns()
+
+
+def _version_timeout():
+    # Области берутся из адреса (/posts/<id>/, /profile/<имя>/), и
+    # вечные ключи копились бы от любого обхода сайта. Пропавшая версия
+    # заменяется новой: это только лишняя сборка страницы.
+    return settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_STALE
+
+
+def get_versions(scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, _version_timeout())
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """Сбрасывает все закэшированные страницы, зависящие от scopes."""
+    cache.set_many(
+        {_version_key(scope): _new_version() for scope in scopes},
+        _version_timeout(),
+    )
+
+
+def bump_post_pages(post, *group_ids):
+    """Сбрасывает ленты и страницы, на которых виден пост."""
+    slugs = Group.objects.filter(
+        pk__in=[pk for pk in group_ids if pk]
+    ).values_list('slug', flat=True)
+    bump(
+        'posts',
+        f'post:{post.pk}',
+        f'profile:{post.author.username}',
+        *(f'group:{slug}' for slug in slugs),
+    )
+
+
+def request_versions(request, scopes, *args, **kwargs):
+    """Версии областей страницы, прочитанные один раз за запрос."""
+    if not hasattr(request, '_page_versions'):
+        request._page_versions = get_versions(
+            scopes(request, *args, **kwargs)
+        )
+    return request._page_versions
+
+
+def page_etag(scopes):
+    """ETag страницы без рендеринга: версии областей, адрес и куки.
+
+    Страницы зависят от пользователя (шапка, кнопка подписки, CSRF-токен
+    формы), поэтому в ETag входят куки сессии и CSRF, а не запрос к БД.
+    """
+    def etag(request, *args, **kwargs):
+        parts = [
+            request.get_full_path(),
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            *request_versions(request, scopes, *args, **kwargs),
+        ]
+        return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+    return etag
+
+
+# Страница в кэше: ответ, до какого времени он свежий и сколько секунд
+# его собирали (от этого зависит, насколько раньше срока его обновлять).
+CachedPage = namedtuple('CachedPage', 'response fresh_until build_time')
+
+# Как часто ждущий запрос проверяет, не собрал ли страницу другой.
+WAIT_POLL_INTERVAL = 0.05
+
+
+def refresh_early(fresh_until, build_time, beta):
+    """Пора ли обновить страницу (XFetch, Vattani et al.).
+
+    До срока страница обновляется с вероятностью, которая растёт к сроку
+    и тем больше, чем дольше её собирать: обновления страниц с одним
+    сроком расходятся во времени, а не случаются разом.
+    """
+    jitter = -build_time * beta * math.log(1 - random.random())
+    return time.time() + jitter >= fresh_until
+
+
+class PageCacheMiddleware(CacheMiddleware):
+    """CacheMiddleware, в котором устаревшую страницу собирает один запрос.
+
+    Собирает страницу тот, кто взял блокировку (cache.add). Пока он
+    работает, остальные получают устаревшую копию, а если копии нет
+    совсем, ждут до PAGE_CACHE_WAIT секунд, пока она появится, и только
+    потом собирают сами. Копия живёт в кэше ещё PAGE_CACHE_STALE секунд
+    после срока свежести; срок, Vary и заголовки - как у cache_page,
+    но страница всегда зависит от кук.
+    """
+
+    def _lock_key(self, request):
+        # Пока список заголовков Vary для страницы неизвестен, ключа
+        # страницы нет, и блокировка берётся на адрес.
+        key = get_cache_key(request, self.key_prefix, 'GET', cache=self.cache)
+        if key is None:
+            url = hashlib.md5(request.build_absolute_uri().encode())
+            key = f'{self.key_prefix}.{url.hexdigest()}'
+        return f'page_lock:{key}'
+
+    def _lock(self, request):
+        key = self._lock_key(request)
+        if not self.cache.add(key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+            return False
+        request._page_lock = key
+        return True
+
+    def _unlock(self, request):
+        key = getattr(request, '_page_lock', None)
+        if key is not None:
+            self.cache.delete(key)
+            del request._page_lock
+
+    def _cached(self, request):
+        methods = ['GET', 'HEAD'] if request.method == 'HEAD' else ['GET']
+        for method in methods:
+            key = get_cache_key(request, self.key_prefix, method,
+                                cache=self.cache)
+            page = self.cache.get(key) if key is not None else None
+            if isinstance(page, CachedPage):
+                return page
+        return None
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            request._cache_update_cache = False
+            return None
+        deadline = time.monotonic() + settings.PAGE_CACHE_WAIT
+        while True:
+            page = self._cached(request)
+            if page is not None and not refresh_early(
+                page.fresh_until, page.build_time, settings.PAGE_CACHE_BETA
+            ):
+                break
+            if self._lock(request):
+                page = None
+                break
+            if page is not None or time.monotonic() >= deadline:
+                break
+            time.sleep(WAIT_POLL_INTERVAL)
+        if page is not None:
+            request._cache_update_cache = False
+            return page.response
+        request._cache_update_cache = True
+        request._page_started = time.monotonic()
+        return None
+
+    def process_exception(self, request, exception):
+        self._unlock(request)
+
+    def process_response(self, request, response):
+        """Как у UpdateCacheMiddleware, но в кэш кладётся CachedPage."""
+        if not self._should_update_cache(request, response):
+            return response
+        # Vary: Cookie выставляют сессии и CSRF уже после кэша, а в
+        # странице пользователь и токен формы: у каждого набора кук своя
+        # копия, и устаревшая тоже достаётся только ему.
+        patch_vary_headers(response, ['Cookie'])
+        timeout = get_max_age(response)
+        if timeout is None:
+            timeout = self.cache_timeout
+        if (
+            response.streaming
+            or response.status_code != 200
+            or (not request.COOKIES and response.cookies
+                and has_vary_header(response, 'Cookie'))
+            or 'private' in response.get('Cache-Control', ())
+            or not timeout
+        ):
+            self._unlock(request)
+            return response
+        patch_response_headers(response, timeout)
+        # Список заголовков Vary живёт столько же, сколько устаревшая
+        # копия: без него ключ страницы не найти.
+        key = learn_cache_key(
+            request, response, timeout + settings.PAGE_CACHE_STALE,
+            self.key_prefix, cache=self.cache,
+        )
+
+        def store(response):
+            build_time = time.monotonic() - request._page_started
+            self.cache.set(
+                key,
+                CachedPage(response, time.time() + timeout, build_time),
+                timeout + settings.PAGE_CACHE_STALE,
+            )
+            self._unlock(request)
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+        return response
+
+
+def protected_cache_page(timeout, *, key_prefix=None):
+    """`cache_page` с PageCacheMiddleware вместо CacheMiddleware."""
+    return decorator_from_middleware_with_args(PageCacheMiddleware)(
+        cache_timeout=timeout, key_prefix=key_prefix
+    )
+
+
+def versioned_cache_page(scopes):
+    """`protected_cache_page`, ключ которого включает версии `scopes`.
+
+    `scopes(request, *args, **kwargs)` возвращает имена областей,
+    от которых зависит страница. Сигналы моделей повышают версии, так
+    что страница живёт в кэше часами и обновляется сразу после
+    изменения своего содержимого. Из тех же версий строится ETag:
+    клиент с актуальной копией получает 304 ещё до поиска в кэше.
+    """
+    def decorator(view):
+        @condition(etag_func=page_etag(scopes))
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            versions = request_versions(request, scopes, *args, **kwargs)
+            key_prefix = '.'.join([view.__name__, *map(str, versions)])
+            cached_view = protected_cache_page(
+                settings.PAGE_CACHE_TIMEOUT, key_prefix=key_prefix
+            )(view)
+            return cached_view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def post_author(post_id):
+    """Имя автора поста: автор не меняется, поэтому храним без срока."""
+    key = f'post_author:{post_id}'
+    username = cache.get(key)
+    if username is None:
+        username = Post.objects.filter(pk=post_id).values_list(
+            'author__username', flat=True
+        ).first()
+        if username is not None:
+            cache.set(key, username, None)
+    return username
+
+
+def index_scopes(request):
+    return ['posts', 'groups']
+
+
+def search_scopes(request):
+    # Выдачу может изменить любой пост: сигналы повышают 'posts' при
+    # каждом сохранении и удалении, а запрос уже входит в адрес.
+    return ['posts', 'groups']
+
+
+def group_scopes(request, slug):
+    return [f'group:{slug}', 'groups']
+
+
+def profile_scopes(request, username):
+    return [f'profile:{username}', 'groups']
+
+
+def post_scopes(request, post_id):
+    return [f'post:{post_id}', f'profile:{post_author(post_id)}', 'groups']
+
+
+def api_post_etag(request, pk):
+    return str(get_versions([f'post:{pk}'])[0])
+
+
+def api_post_last_modified(request, pk):
+    return Post.objects.filter(pk=pk).values_list(
+        'edited', flat=True
+    ).first()
@@ -0,0 +1,183 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+`posts_post_fts` - FTS5-таблица с внешним содержимым: сам текст лежит
+в `posts_post`, а индекс обновляют триггеры на вставку, изменение
+текста и удаление поста. Триггеры срабатывают и на пакетные вставки
+import_posts, которые обходят сигналы моделей.
+
+Результаты упорядочены по релевантности BM25 (при равной - новые выше)
+и листаются курсором по паре (score, id), как ленты по (pub_date, id).
+"""
+import re
+
+from django.db import connection
+
+from .utils import OLDER, KeysetPaginator
+
+TABLE = 'posts_post_fts'
+# unicode61 снимает диакритику только с латиницы, поэтому ё приводится
+# к е и в индексе, и в запросе.
+NORMALIZED = "replace(replace({}, 'ё', 'е'), 'Ё', 'Е')"
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        text, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TABLE}_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {TABLE} (rowid, text)
+        VALUES (new.id, {NORMALIZED.format('new.text')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TABLE}_delete
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, text)
+        VALUES ('delete', old.id, {NORMALIZED.format('old.text')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {TABLE}_update
+    AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, text)
+        VALUES ('delete', old.id, {NORMALIZED.format('old.text')});
+        INSERT INTO {TABLE} (rowid, text)
+        VALUES (new.id, {NORMALIZED.format('new.text')});
+    END
+    """,
+]
+DROP_SQL = [
+    f'DROP TRIGGER IF EXISTS {TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {TABLE}_update',
+    f'DROP TABLE IF EXISTS {TABLE}',
+]
+# Не 'rebuild': он индексировал бы текст без замены ё.
+FILL_SQL = (
+    f"INSERT INTO {TABLE} (rowid, text) "
+    f"SELECT id, {NORMALIZED.format('text')} FROM posts_post"
+)
+
+WORD = re.compile(r'\w+')
+# Короткий префикс совпадает с тысячами слов, а ранжировать приходится
+# все найденные посты, поэтому префиксом ищется только длинное слово.
+PREFIX_MIN_LENGTH = 4
+
+
+def available(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install(using=connection):
+    """Создаёт индекс, триггеры и заполняет индекс текущими постами."""
+    if not available(using):
+        return
+    with using.cursor() as cursor:
+        for statement in CREATE_SQL:
+            cursor.execute(statement)
+        cursor.execute(FILL_SQL)
+
+
+def restore_triggers(using=connection):
+    """Возвращает триггеры, если индекс есть, а их нет.
+
+    Миграция, пересоздающая таблицу posts_post на SQLite, теряет её
+    триггеры, поэтому это делается после каждого migrate.
+    """
+    if not available(using):
+        return
+    if TABLE not in using.introspection.table_names():
+        return
+    with using.cursor() as cursor:
+        for statement in CREATE_SQL[1:]:
+            cursor.execute(statement)
+
+
+def uninstall(using=connection):
+    if not available(using):
+        return
+    with using.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+def match_expression(query):
+    """Запрос пользователя в выражение MATCH.
+
+    Берутся только слова, каждое в кавычках, последнее (если оно не
+    короче PREFIX_MIN_LENGTH) - как префикс, так что операторы FTS5
+    и незакрытые кавычки не дают ошибок. Пустая строка значит, что
+    искать нечего.
+    """
+    words = WORD.findall((query or '').replace('ё', 'е').replace('Ё', 'Е'))
+    if not words:
+        return ''
+    expression = ' '.join(f'"{word}"' for word in words)
+    if len(words[-1]) >= PREFIX_MIN_LENGTH:
+        expression += '*'
+    return expression
+
+
+def filter_matching(queryset, query):
+    """Оставляет в queryset постов только подходящие под запрос."""
+    # RawSQL в pk__in дал бы "IN ((SELECT ...))", то есть сравнение
+    # с первой строкой подзапроса, а не со всеми.
+    return queryset.extra(
+        where=[
+            f'{queryset.model._meta.db_table}.id IN '
+            f'(SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s)'
+        ],
+        params=[match_expression(query)],
+    )
+
+
+class SearchPaginator(KeysetPaginator):
+    """Страницы результатов поиска по курсору (score, id).
+
+    `object_list` - queryset постов (select_related и т. п.), из которого
+    берутся найденные по индексу id; у постов появляется атрибут `score`.
+    """
+
+    def __init__(self, object_list, per_page, query):
+        super().__init__(object_list, per_page, keys=('score', 'id'))
+        self.expression = match_expression(query)
+
+    def _to_python(self, values):
+        score, pk = values
+        return [float(score), int(pk)]
+
+    def _fetch(self, direction, position, limit):
+        if not self.expression:
+            return []
+        if direction == OLDER:
+            compare, order = '<', 'DESC'
+        else:
+            compare, order = '>', 'ASC'
+        where, params = '', [self.expression]
+        if position is not None:
+            where = (
+                f'WHERE score {compare} %s '
+                f'OR (score = %s AND id {compare} %s)'
+            )
+            params += [position[0], position[0], position[1]]
+        # bm25 меньше у более релевантных, поэтому score = -bm25.
+        sql = (
+            f'SELECT id, score FROM ('
+            f'SELECT rowid AS id, -bm25({TABLE}) AS score FROM {TABLE} '
+            f'WHERE {TABLE} MATCH %s) {where} '
+            f'ORDER BY score {order}, id {order} LIMIT %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            hits = cursor.fetchall()
+        posts = self.object_list.in_bulk([pk for pk, _ in hits])
+        found = []
+        for pk, score in hits:
+            if pk in posts:
+                posts[pk].score = score
+                found.append(posts[pk])
+        return found
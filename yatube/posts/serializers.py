@@ -1,9 +1,60 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import Post
+from .models import Comment, Post
 
 
 class PostSerializer(serializers.ModelSerializer):
     class Meta:
         fields = ('text', 'author', 'pub_date')
         model = Post
+
+
+class CommentSerializer(serializers.ModelSerializer):
+    author = serializers.SlugRelatedField(
+        slug_field='username', read_only=True
+    )
+
+    class Meta:
+        fields = ('id', 'text', 'author', 'created')
+        model = Comment
+
+
+# Поля списка постов в API и пути к ним для values()
+POST_API_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'pub_date': 'pub_date',
+    'image': 'image',
+    'image_width': 'image_width',
+    'image_height': 'image_height',
+    'comments_count': 'comments_count',
+}
+
+
+def api_fields(requested):
+    """Запрошенные через ?fields= поля; неизвестные имена отбрасываются."""
+    if not requested:
+        return list(POST_API_FIELDS)
+    names = [name.strip() for name in requested.split(',')]
+    return [name for name in names if name in POST_API_FIELDS] or ['id']
+
+
+def _value(obj, path):
+    if isinstance(obj, dict):
+        return obj[path]
+    for attr in path.split('__'):
+        obj = getattr(obj, attr, None)
+    return obj
+
+
+def post_row(obj, fields):
+    """Пост (экземпляр или строка values()) в словарь с полями fields."""
+    row = {name: _value(obj, POST_API_FIELDS[name]) for name in fields}
+    if 'image' in row:
+        row['image'] = (
+            settings.MEDIA_URL + str(row['image']) if row['image'] else None
+        )
+    return row
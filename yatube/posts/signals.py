@@ -0,0 +1,102 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, page_cache, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, UserStats
+from .utils import GROUP_CHOICES_KEY, feed_count_key
+
+User = get_user_model()
+
+
+def _drop_feed_counts(post, *group_ids):
+    cache.delete_many([
+        feed_count_key('index'),
+        feed_count_key('author', post.author_id),
+        *(feed_count_key('group', pk) for pk in group_ids if pk),
+    ])
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    instance._previous_group_id = None
+    if instance.pk is not None:
+        instance._previous_group_id = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    previous_group_id = instance._previous_group_id
+    page_cache.bump_post_pages(instance, previous_group_id, instance.group_id)
+    thumbnails.schedule(instance)
+    if created:
+        counters.shift_user(instance.author_id, 'posts_count', 1)
+        _drop_feed_counts(instance, instance.group_id)
+        timeline.fan_out(instance)
+    elif previous_group_id != instance.group_id:
+        cache.delete_many([
+            feed_count_key('group', pk)
+            for pk in (previous_group_id, instance.group_id) if pk
+        ])
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.shift_user(instance.author_id, 'posts_count', -1)
+    _drop_feed_counts(instance, instance.group_id)
+    page_cache.bump_post_pages(instance, instance.group_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.shift_comments(instance.post_id, 1)
+    page_cache.bump(f'post:{instance.post_id}')
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.shift_comments(instance.post_id, -1)
+    page_cache.bump(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    cache.delete(GROUP_CHOICES_KEY)
+    page_cache.bump('groups')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.shift_user(instance.author_id, 'followers_count', 1)
+        counters.shift_user(instance.user_id, 'following_count', 1)
+        timeline.reclassify([instance.author_id])
+        timeline.backfill(instance.user_id, instance.author_id)
+    _bump_profiles(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.shift_user(instance.author_id, 'followers_count', -1)
+    counters.shift_user(instance.user_id, 'following_count', -1)
+    timeline.reclassify([instance.author_id])
+    timeline.prune(instance.user_id, instance.author_id)
+    _bump_profiles(instance)
+
+
+def _bump_profiles(follow):
+    page_cache.bump(
+        f'profile:{follow.user.username}',
+        f'profile:{follow.author.username}',
+    )
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - хэш его содержимого.
+
+    Файл `posts/photo.jpg` сохраняется как `posts/3f/3f9c…e1.jpg`, где
+    3f9c…e1 - SHA-256 содержимого. Одинаковые загрузки ложатся в один
+    файл и делят миниатюры, а подбирать свободное имя не нужно: занятое
+    имя значит, что такой файл уже есть. Поэтому файлы удаляет не пост,
+    а gc_media, которая знает все ссылки на них.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        hexdigest = digest.hexdigest()
+        return os.path.join(
+            directory, hexdigest[:2], hexdigest + extension
+        ).replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return super().save(
+            self.content_name(name, content), content, max_length
+        )
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            # Свежее время изменения не даёт gc_media удалить файл, пока
+            # пост с ним ещё не сохранён.
+            os.utime(self.path(name))
+            return name
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # Пишем рядом и переименовываем: параллельная загрузка того же
+        # файла заменит его тем же содержимым, а читатели не увидят
+        # недописанный файл.
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(full_path), suffix='.part'
+        )
+        if hasattr(content, 'temporary_file_path'):
+            os.close(fd)
+            file_move_safe(
+                content.temporary_file_path(), temp_path,
+                allow_overwrite=True,
+            )
+        else:
+            with os.fdopen(fd, 'wb') as target:
+                for chunk in content.chunks():
+                    target.write(chunk)
+        # mkstemp создаёт файл с правами 0600, а media раздаёт веб-сервер.
+        os.chmod(temp_path, self.file_permissions_mode or 0o644)
+        os.replace(temp_path, full_path)
+        return name
@@ -0,0 +1,11 @@
+from django import template
+
+from posts.thumbnails import picture
+
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_picture(post):
+    return picture(post)
@@ -0,0 +1,134 @@
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import page_cache
+from posts.models import Comment, Follow, Group, Post
+from posts.utils import feed_count_key
+
+
+User = get_user_model()
+
+
+class PostAdminTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        cls.author = User.objects.create_user(username='admin_author')
+        cls.group = Group.objects.create(
+            title='Старая', slug='old_group', description='d'
+        )
+        cls.target = Group.objects.create(
+            title='Новая', slug='new_group', description='d'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.author, text=f'admin post {i}', group=cls.group
+            )
+            for i in range(5)
+        ]
+        for post in cls.posts:
+            Comment.objects.create(post=post, author=cls.admin, text='c')
+        Follow.objects.create(user=cls.admin, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.admin)
+
+    def changelist(self, model, **params):
+        url = reverse(f'admin:posts_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries]
+
+    def test_changelists_join_and_skip_full_count(self):
+        """ ADMIN | Списки постов, комментариев и подписок: связи одним
+        JOIN, без COUNT(*) по всей таблице, запросов не больше с ростом
+        числа строк """
+        for model in ('post', 'comment', 'follow'):
+            with self.subTest(model=model):
+                _, queries = self.changelist(model)
+                full_counts = [
+                    sql for sql in queries
+                    if 'COUNT(*)' in sql and 'LIMIT' not in sql
+                ]
+                self.assertEqual(full_counts, [])
+                self.assertFalse(any(
+                    'FROM "auth_user" WHERE "auth_user"."id" = 2' in sql
+                    for sql in queries
+                ))
+        _, before = self.changelist('post')
+        Post.objects.create(author=self.author, text='one more')
+        _, after = self.changelist('post')
+        self.assertEqual(len(after), len(before))
+
+    @override_settings(ADMIN_COUNT_LIMIT=2)
+    def test_count_is_capped_and_estimated(self):
+        """ ADMIN | Выше предела число строк оценивается по id, а для
+        фильтра остаётся равным пределу """
+        response, _ = self.changelist('post')
+        self.assertEqual(
+            response.context['cl'].result_count, self.posts[-1].pk
+        )
+        response, _ = self.changelist('post', group=self.group.pk)
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_group_choices_are_cached(self):
+        """ ADMIN | Список групп для фильтра и действия читается из кэша
+        и сбрасывается при изменении групп """
+        self.changelist('post')
+        _, queries = self.changelist('post')
+        self.assertFalse(any('FROM "posts_group"' in sql and 'WHERE' not in sql
+                             for sql in queries))
+        Group.objects.create(title='Третья', slug='third', description='d')
+        response, _ = self.changelist('post')
+        self.assertContains(response, 'Третья')
+
+    def test_group_edit_uses_autocomplete(self):
+        """ ADMIN | Группа в строке списка - автодополнение, а не <select>
+        со всеми группами """
+        response, _ = self.changelist('post')
+        self.assertContains(response, 'admin-autocomplete')
+        # Единственный полный список групп - в форме действия.
+        self.assertContains(
+            response, f'<option value="{self.target.pk}">Новая</option>',
+            count=1,
+        )
+
+    def test_move_to_group_is_one_update(self):
+        """ ADMIN | Перенос в группу - один UPDATE со сбросом счётчиков
+        лент, кэша страниц и ETag перенесённых постов """
+        cache.set(feed_count_key('group', self.group.pk), 5)
+        cache.set(feed_count_key('group', self.target.pk), 0)
+        version = page_cache.get_versions(['groups'])
+        moved = self.posts[:3]
+        api_url = reverse('posts:post_ser', args=(moved[0].pk,))
+        etag = self.client.get(api_url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('admin:posts_post_changelist'), {
+                'action': 'move_to_group',
+                'group': self.target.pk,
+                ACTION_CHECKBOX_NAME: [post.pk for post in moved],
+            })
+        updates = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "posts_post"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            Post.objects.filter(group=self.target).count(), len(moved)
+        )
+        self.assertIsNone(cache.get(feed_count_key('group', self.group.pk)))
+        self.assertIsNone(cache.get(feed_count_key('group', self.target.pk)))
+        self.assertNotEqual(page_cache.get_versions(['groups']), version)
+        response = self.client.get(api_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,97 @@
+import csv
+import json
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Group, Post
+
+
+User = get_user_model()
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.author = User.objects.create_user(username='writer')
+        cls.group = Group.objects.create(
+            title='group', slug='export_group', description='d'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.author, text=f'post {i}',
+                group=cls.group if i % 2 else None,
+            )
+            for i in range(5)
+        ]
+        Comment.objects.create(
+            post=cls.posts[1], author=cls.staff, text='first'
+        )
+        Comment.objects.create(
+            post=cls.posts[1], author=cls.author, text='second'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+        self.url = reverse('posts:posts_export')
+
+    def export(self, **params):
+        response = self.staff_client.get(self.url, params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_requires_staff(self):
+        """ EXPORT | Выгрузка доступна только персоналу """
+        author_client = Client()
+        author_client.force_login(self.author)
+        response = author_client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_ndjson_with_comments(self):
+        """ EXPORT | NDJSON: все посты по порядку id, комментарии внутри """
+        rows = [
+            json.loads(line)
+            for line in self.export(comments=1).splitlines()
+        ]
+        self.assertEqual(
+            [row['id'] for row in rows], [post.id for post in self.posts]
+        )
+        self.assertEqual(
+            [c['text'] for c in rows[1]['comments']], ['first', 'second']
+        )
+        self.assertEqual(rows[1]['group'], self.group.slug)
+
+    def test_export_csv_filters(self):
+        """ EXPORT | CSV с фильтром по группе и пачками меньше выборки """
+        with self.settings(EXPORT_CHUNK_SIZE=1):
+            rows = list(csv.DictReader(StringIO(
+                self.export(format='csv', group=self.group.slug, comments=1)
+            )))
+        self.assertEqual(
+            [(row['kind'], row['text']) for row in rows],
+            [('post', 'post 1'), ('comment', 'first'),
+             ('comment', 'second'), ('post', 'post 3')],
+        )
+
+    def test_export_rejects_bad_dates(self):
+        """ EXPORT | Неверная дата - 400 во view и ошибка в команде """
+        response = self.staff_client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(CommandError):
+            call_command('export_posts', since='yesterday')
+
+    def test_export_command(self):
+        """ EXPORT | Команда пишет NDJSON с фильтром по дате """
+        out = StringIO()
+        call_command('export_posts', until='2000-01-01', stdout=out)
+        self.assertEqual(out.getvalue(), '')
+        call_command('export_posts', author='writer', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), len(self.posts))
@@ -1,11 +1,14 @@
 import shutil
 import tempfile
 from http import HTTPStatus
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django.conf import settings
+from django.db.models import F
 from django.test import TestCase, Client, override_settings
 
 from posts.models import Post, Group
@@ -47,6 +50,7 @@ class PostFormsTest(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.user = User.objects.get(username='auth')
         self.authorized_client = Client()
@@ -115,6 +119,27 @@ class PostFormsTest(TestCase):
             ).exists()
         )
 
+    def test_edit_keeps_concurrent_comment_count(self):
+        """ FORMS | Правка поста не затирает счётчик комментариев,
+        изменившийся во время запроса """
+        is_valid = PostForm.is_valid
+
+        def comment_meanwhile(form):
+            Post.objects.filter(pk=self.post.pk).update(
+                comments_count=F('comments_count') + 1
+            )
+            return is_valid(form)
+        with mock.patch.object(PostForm, 'is_valid', comment_meanwhile):
+            self.authorized_client.post(
+                reverse('posts:post_edit', args=(self.post.pk,)),
+                data={'text': 'edited while commented'},
+            )
+        self.post.refresh_from_db()
+        self.assertEqual(
+            (self.post.text, self.post.comments_count),
+            ('edited while commented', 1),
+        )
+
     def test_edit_group(self):
         """ Тестируем, что после изменения группы
         поста нет на странице старой группы """
@@ -144,6 +169,8 @@ class PostFormsTest(TestCase):
             reverse('posts:add_comment',
                     args={self.post.pk}), data=form_data, follow=True)
         self.assertEqual(response.status_code, HTTPStatus.OK)
+        # Страница уже в кэше, а у ответа из кэша нет context
+        cache.clear()
         response = self.authorized_client.get(
             reverse('posts:post_detail', args={self.post.pk})
         )
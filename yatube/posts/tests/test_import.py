@@ -0,0 +1,124 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry,
+                          UserStats)
+
+
+User = get_user_model()
+
+
+class ImportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        cls.group = Group.objects.create(
+            title='group', slug='import_group', description='d'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def load(self, records, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as source:
+            for record in records:
+                source.write(
+                    record if isinstance(record, str) else json.dumps(record)
+                )
+                source.write('\n')
+            source.flush()
+            out = StringIO()
+            call_command('import_posts', source.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_posts_comments_and_follows(self):
+        """ IMPORT | Посты, комментарии и подписки с пересчётом счётчиков
+        и лент """
+        self.client.get(reverse('posts:index'))
+        output = self.load([
+            {'id': 10, 'author': 'writer', 'group': 'import_group',
+             'text': 'old post', 'pub_date': '2020-01-02T03:04:05+00:00',
+             'comments': [{'author': 'reader', 'text': 'nested'}]},
+            {'type': 'comment', 'post': 10, 'author': 'newbie',
+             'text': 'standalone'},
+            {'type': 'follow', 'user': 'newbie', 'author': 'writer'},
+            {'author': 'ghost', 'text': 'unknown author', 'group': 'nope'},
+            'not json',
+        ], '--create-missing', '--chunk-size', '2')
+        self.assertIn('пропущено: 1', output)
+
+        post = Post.objects.get(text='old post')
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(post.group, self.group)
+        self.assertEqual(post.comments_count, 2)
+        newbie = User.objects.get(username='newbie')
+        self.assertEqual(
+            Comment.objects.get(text='standalone').author, newbie
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 2
+        )
+        for user in (self.reader, newbie):
+            self.assertTrue(TimelineEntry.objects.filter(
+                user=user, post=post
+            ).exists())
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'old post')
+
+    def test_skipped_post_creates_nothing(self):
+        """ IMPORT | Пост с битым комментарием пропускается целиком, без
+        созданных для него авторов и групп """
+        output = self.load([
+            {'author': 'lost_author', 'group': 'lost_group', 'text': 'post',
+             'comments': [{'author': 'lost_reader', 'text': 'ok'},
+                          {'author': 'reader', 'text': 'bad',
+                           'created': 'never'}]},
+            {'author': 'kept', 'text': 'next post'},
+        ], '--create-missing')
+        self.assertIn('Постов: 1', output)
+        self.assertIn('пропущено: 1', output)
+        self.assertFalse(User.objects.filter(
+            username__in=['lost_author', 'lost_reader']
+        ).exists())
+        self.assertFalse(Group.objects.filter(slug='lost_group').exists())
+        self.assertEqual(
+            Post.objects.get(text='next post').author.username, 'kept'
+        )
+
+    def test_comment_of_skipped_post_is_skipped(self):
+        """ IMPORT | Комментарий к пропущенному посту не попадает к
+        следующему посту """
+        output = self.load([
+            {'id': 5, 'author': 'writer'},
+            {'id': 6, 'author': 'writer', 'text': 'b'},
+            {'type': 'comment', 'post': 5, 'author': 'reader',
+             'text': 'for the skipped post'},
+        ])
+        self.assertIn('пропущено: 2', output)
+        post = Post.objects.get(text='b')
+        self.assertFalse(post.comments.exists())
+        self.assertFalse(
+            Comment.objects.filter(text='for the skipped post').exists()
+        )
+
+    def test_import_reads_export(self):
+        """ IMPORT | Выгрузка export_posts загружается обратно """
+        post = Post.objects.create(author=self.author, text='round trip')
+        Comment.objects.create(post=post, author=self.reader, text='reply')
+        exported = StringIO()
+        call_command('export_posts', comments=True, stdout=exported)
+        Post.objects.all().delete()
+        self.load(exported.getvalue().splitlines())
+        post = Post.objects.get()
+        self.assertEqual(post.text, 'round trip')
+        self.assertEqual(post.comments.get().text, 'reply')
@@ -0,0 +1,83 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from posts.models import Comment, Follow, Post, TimelineEntry
+from posts.utils import NEWER, OLDER, keyset_window
+
+
+User = get_user_model()
+
+KEYS = ('pub_date', 'id')
+
+
+def query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class FeedQueryPlanTest(TestCase):
+    """Ленты должны читаться по индексу, без полного скана и сортировки."""
+
+    def setUp(self):
+        position = [timezone.now(), 100]
+        posts = Post.objects.select_related('author', 'group')
+        entries = TimelineEntry.objects.filter(
+            user_id=1
+        ).select_related('post__author', 'post__group')
+        self.queries = {}
+        for direction in (OLDER, NEWER):
+            for start in (None, position):
+                name = f'{direction} from {start and "cursor" or "top"}'
+                self.queries.update({
+                    f'index {name}': keyset_window(
+                        posts, KEYS, direction, start, 11
+                    ),
+                    f'group {name}': keyset_window(
+                        posts.filter(group_id=1), KEYS, direction, start, 11
+                    ),
+                    f'profile {name}': keyset_window(
+                        posts.filter(author_id=1), KEYS, direction, start, 11
+                    ),
+                    f'follow {name}': keyset_window(
+                        entries, ('pub_date', 'post_id'), direction, start,
+                        11
+                    ),
+                    f'comments {name}': keyset_window(
+                        Comment.objects.filter(
+                            post_id=1
+                        ).select_related('author'),
+                        ('created', 'id'), direction, start, 21
+                    ),
+                })
+        self.queries['is following'] = Follow.objects.filter(
+            user_id=1, author_id=2
+        )
+
+    def test_feeds_use_indexes(self):
+        """ PLANS | Ленты не сканируют таблицы и не сортируют во временном
+        B-дереве """
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        for name, queryset in self.queries.items():
+            with self.subTest(query=name):
+                for step in query_plan(queryset):
+                    self.assertNotIn('TEMP B-TREE', step)
+                    if step.startswith('SCAN'):
+                        self.assertIn('INDEX', step)
+                        # С курсора страница ищется по диапазону индекса,
+                        # а не перебором от самых новых постов.
+                        self.assertNotIn('cursor', name)
+
+    def test_follow_is_unique(self):
+        """ PLANS | Повторная подписка запрещена на уровне БД """
+        user = User.objects.create_user(username='reader')
+        author = User.objects.create_user(username='writer')
+        Follow.objects.create(user=user, author=author)
+        Follow.objects.bulk_create(
+            [Follow(user=user, author=author)], ignore_conflicts=True
+        )
+        self.assertEqual(Follow.objects.count(), 1)
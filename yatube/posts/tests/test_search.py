@@ -0,0 +1,117 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Post
+
+
+User = get_user_model()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        cls.author = User.objects.create_user(username='searcher')
+        cls.best = Post.objects.create(
+            author=cls.author, text='Ёжик в тумане, ёжик ищет лошадку'
+        )
+        cls.other = Post.objects.create(
+            author=cls.author,
+            text='Длинный пост про лес, реку, туман и одного ежика где-то '
+                 'в самом конце очень длинной истории',
+        )
+        cls.miss = Post.objects.create(author=cls.author, text='Про котов')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def api(self, **params):
+        return self.client.get(reverse('posts:search_api'), params).json()
+
+    def test_ranked_results(self):
+        """ SEARCH | Поиск без учёта регистра и диакритики, релевантные
+        выше, последнее слово - префикс """
+        ids = [row['id'] for row in self.api(q='ежик')['results']]
+        self.assertEqual(ids, [self.best.pk, self.other.pk])
+        ids = [row['id'] for row in self.api(q='тума')['results']]
+        self.assertCountEqual(ids, [self.best.pk, self.other.pk])
+        self.assertEqual(self.api(q='собака')['results'], [])
+
+    def test_index_follows_changes(self):
+        """ SEARCH | Индекс видит изменения текста, в том числе через
+        update(), и удаление постов """
+        Post.objects.filter(pk=self.miss.pk).update(text='Кот и ёжик')
+        ids = [row['id'] for row in self.api(q='кот')['results']]
+        self.assertEqual(ids, [self.miss.pk])
+        self.assertEqual(self.api(q='котов')['results'], [])
+        Post.objects.get(pk=self.best.pk).delete()
+        ids = [row['id'] for row in self.api(q='ежик')['results']]
+        self.assertNotIn(self.best.pk, ids)
+
+    def test_keyset_pages(self):
+        """ SEARCH | Курсоры next/previous листают результаты без
+        пропусков и повторов """
+        first = self.api(q='ежик', limit=1, fields='id')
+        second = self.api(q='ежик', limit=1, fields='id',
+                          cursor=first['next'])
+        self.assertEqual(
+            [first['results'][0]['id'], second['results'][0]['id']],
+            [self.best.pk, self.other.pk],
+        )
+        self.assertIsNone(second['next'])
+        back = self.api(q='ежик', limit=1, cursor=second['previous'])
+        self.assertEqual(back['results'][0]['id'], self.best.pk)
+
+    def test_query_syntax_is_not_an_error(self):
+        """ SEARCH | Кавычки и операторы FTS5 в запросе не ломают поиск """
+        for query in ('"', 'ежик AND (', 'NEAR(', '*', ''):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.client.get(reverse('posts:search_api'),
+                                    {'q': query}).status_code,
+                    200,
+                )
+
+    def test_search_page(self):
+        """ SEARCH | Страница поиска показывает найденное и сохраняет
+        запрос в ссылках пагинатора """
+        with self.settings(DEF_NUM_POSTS=1):
+            response = self.client.get(reverse('posts:search'), {'q': 'ежик'})
+        self.assertEqual(list(response.context['page_obj']), [self.best])
+        self.assertContains(response, 'href="?q=%D0%B5%D0%B6%D0%B8%D0%BA&amp;'
+                                      'cursor=')
+
+    def test_search_page_cache_follows_posts(self):
+        """ SEARCH | Страница поиска из кэша обновляется новым постом и
+        не отдаётся другому пользователю """
+        url = reverse('posts:search')
+        self.client.get(url, {'q': 'лошадку'})
+        post = Post.objects.create(author=self.author, text='Лошадку нашли')
+        self.assertContains(self.client.get(url, {'q': 'лошадку'}),
+                            post.text)
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get(url, {'q': 'лошадку'}),
+                            f'Пользователь: {self.admin.username}')
+
+    def test_admin_search_uses_index(self):
+        """ ADMIN | Поиск в админке идёт по индексу FTS5, а не LIKE """
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'ежик'}
+            )
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertIn('MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            {self.best, self.other},
+        )
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from posts import thumbnails
+from posts.models import Post
+
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='reposter')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create(self, filename, content):
+        return Post.objects.create(
+            author=self.author,
+            text=filename,
+            image=SimpleUploadedFile(filename, content, 'image/gif'),
+        )
+
+    def test_identical_uploads_share_file(self):
+        """ STORAGE | Одинаковые картинки под разными именами хранятся
+        одним файлом, названным по хэшу содержимого """
+        first = self.create('cat.GIF', SMALL_GIF)
+        second = self.create('repost.gif', SMALL_GIF)
+        other = self.create('cat.gif', SMALL_GIF + b'\0')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        directory, filename = os.path.split(first.image.name)
+        self.assertEqual(directory, f'posts/{filename[:2]}')
+        self.assertRegex(filename, r'^[0-9a-f]{64}\.gif$')
+        with open(first.image.path, 'rb') as stored:
+            self.assertEqual(stored.read(), SMALL_GIF)
+
+    def test_shared_file_shares_thumbnails(self):
+        """ STORAGE | Повторная картинка берёт готовые миниатюры
+        и размеры первой """
+        first = self.create('first.gif', SMALL_GIF)
+        thumbnails.generate(first.image.name, first.pk)
+        second = self.create('second.gif', SMALL_GIF)
+        self.assertEqual(thumbnails.rebuild(second.image.name), 0)
+        thumbnails.generate(second.image.name, second.pk)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.image_placeholder, first.image_placeholder)
+        self.assertEqual(
+            thumbnails.ready_url(second.image, 'card'),
+            thumbnails.ready_url(first.image, 'card'),
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaGCTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='collector')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create(self, content):
+        post = Post.objects.create(
+            author=self.author,
+            text='post for gc',
+            image=SimpleUploadedFile('gc.gif', content, 'image/gif'),
+        )
+        thumbnails.generate(post.image.name, post.pk)
+        return post
+
+    def age(self, *paths):
+        past = time.time() - 2 * 3600
+        for path in paths:
+            os.utime(path, (past, past))
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command('gc_media', '--min-age', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_orphans_and_their_thumbnails_are_removed(self):
+        """ GC_MEDIA | Картинка без поста удаляется с миниатюрами и
+        записями sorl, живые и свежие файлы остаются """
+        post = self.create(SMALL_GIF + b'kept')
+        replaced = self.create(SMALL_GIF + b'old')
+        old_name = replaced.image.name
+        old_path = replaced.image.path
+        geometry, options = settings.POST_THUMBNAILS['card']
+        card = thumbnails.backend.lookup(old_name, geometry, **options)
+        replaced.image = SimpleUploadedFile('new.gif', SMALL_GIF + b'new')
+        replaced.save()
+        young = default.storage.save(
+            'posts/young.gif', SimpleUploadedFile('y.gif', SMALL_GIF)
+        )
+        stray = default.storage.save(
+            f'{sorl_settings.THUMBNAIL_PREFIX}stray.jpg',
+            SimpleUploadedFile('stray.jpg', b'jpeg')
+        )
+        self.age(old_path, post.image.path, default.storage.path(stray),
+                 default.storage.path(card.name))
+
+        self.assertIn('Убрано 2', self.gc())
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(card.exists())
+        self.assertIsNone(default.kvstore.get(ImageFile(old_name)))
+        self.assertFalse(default.storage.exists(stray))
+        self.assertTrue(os.path.exists(post.image.path))
+        self.assertTrue(default.storage.exists(young))
+        self.assertIsNotNone(thumbnails.ready_url(post.image, 'card'))
+
+    def test_quarantine_and_dry_run_keep_files(self):
+        """ GC_MEDIA | --dry-run ничего не трогает, --quarantine переносит
+        файлы вместо удаления """
+        orphan = default.storage.save(
+            'posts/orphan.gif', SimpleUploadedFile('o.gif', SMALL_GIF)
+        )
+        path = default.storage.path(orphan)
+        self.age(path)
+        self.assertIn(orphan, self.gc('--dry-run'))
+        self.assertTrue(os.path.exists(path))
+        quarantine = os.path.join(TEMP_MEDIA_ROOT, '..', 'quarantine')
+        self.addCleanup(shutil.rmtree, quarantine, True)
+        self.gc('--quarantine', quarantine)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(quarantine, orphan)))
@@ -0,0 +1,233 @@
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.engines import pil_engine
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from sorl.thumbnail.parsers import parse_geometry
+
+from posts import thumbnail_engine, thumbnails
+from posts.management.commands.backfill_thumbnails import _signature
+from posts.models import Post
+
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='painter')
+        cls.post, cls.other = [
+            Post.objects.create(
+                author=cls.author,
+                text=f'post with picture {i}',
+                # Разное содержимое: одинаковые файлы хранилище склеивает.
+                image=SimpleUploadedFile(
+                    f'thumb{i}.gif', SMALL_GIF + bytes(i),
+                    content_type='image/gif'
+                ),
+            )
+            for i in range(2)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        default.kvstore._lru.clear()
+        self.client = Client()
+
+    def test_thumbnail_falls_back_to_original(self):
+        """ THUMBNAILS | Пока миниатюры нет, шаблон отдаёт оригинал и не
+        создаёт её сам """
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'src="{self.post.image.url}"')
+        # У оригинала свои пропорции, не кадра карточки.
+        self.assertNotContains(response, 'width="960"')
+        geometry, options = settings.POST_THUMBNAILS['card']
+        self.assertIsNone(thumbnails.backend.lookup(
+            self.post.image.name, geometry, **options
+        ))
+
+    def test_original_has_its_stored_size(self):
+        """ THUMBNAILS | Оригинал вместо миниатюры выводится со своими
+        сохранёнными размерами """
+        Post.objects.filter(pk=self.post.pk).update(
+            image_width=2, image_height=1
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        self.assertContains(response, f'src="{self.post.image.url}"')
+        self.assertContains(response, 'width="2" height="1"')
+
+    def test_generated_thumbnail_replaces_cached_page(self):
+        """ THUMBNAILS | После фоновой генерации страницы из кэша
+        показывают миниатюру """
+        url = reverse('posts:profile', kwargs={'username': 'painter'})
+        self.client.get(url)
+        thumbnails.generate(self.post.image.name, self.post.pk)
+        thumbnail = thumbnails.backend.lookup(
+            self.post.image.name, '960x339', crop='center', upscale=True
+        )
+        self.assertIsNotNone(thumbnail)
+        self.assertEqual(
+            thumbnails.ready_url(self.post.image, 'card'), thumbnail.url
+        )
+        self.assertContains(self.client.get(url), f'src="{thumbnail.url}"')
+
+    def test_feed_reads_thumbnails_in_one_query(self):
+        """ THUMBNAILS | Лента читает миниатюры страницы одним запросом,
+        повторно - из LRU процесса """
+        for post in (self.post, self.other):
+            thumbnails.generate(post.image.name)
+        default.kvstore._lru.clear()
+        url = reverse('posts:index')
+        for expected in (1, 0):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            kv_queries = [
+                query for query in queries.captured_queries
+                if 'thumbnail_kvstore' in query['sql']
+            ]
+            self.assertEqual(len(kv_queries), expected)
+            self.assertNotContains(response, f'src="{self.post.image.url}"')
+
+    def test_missing_thumbnail_is_not_cached(self):
+        """ THUMBNAILS | Промах не кэшируется: миниатюру, созданную другим
+        процессом, видно сразу """
+        geometry, options = settings.POST_THUMBNAILS['card']
+        thumbnails.generate(self.post.image.name)
+        rows = list(KVStoreModel.objects.all())
+        KVStoreModel.objects.all().delete()
+        cache.clear()
+        default.kvstore._lru.clear()
+        self.assertIsNone(thumbnails.backend.lookup(
+            self.post.image.name, geometry, **options
+        ))
+        # Запись другого процесса: в базе, но не в кэше этого.
+        KVStoreModel.objects.bulk_create(rows)
+        self.assertIsNotNone(thumbnails.backend.lookup(
+            self.post.image.name, geometry, **options
+        ))
+
+    def test_generate_stores_size_and_placeholder(self):
+        """ THUMBNAILS | После генерации у поста есть размеры картинки
+        и placeholder, а карточка отдаёт srcset, размеры и lazy """
+        thumbnails.generate(self.post.image.name, self.post.pk)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,')
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        )
+        small = thumbnails.ready_url(post.image, 'card_480')
+        self.assertIsNotNone(small)
+        self.assertContains(response, f'{small} 480w')
+        self.assertContains(response, 'width="960"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, post.image_placeholder)
+
+    def test_unsupported_formats_are_skipped(self):
+        """ THUMBNAILS | Варианты в форматах, которые Pillow не умеет
+        писать, не создаются и не попадают в srcset """
+        with mock.patch.dict(Image.SAVE, clear=False):
+            Image.SAVE.pop('WEBP', None)
+            enabled = thumbnails.enabled_thumbnails()
+            self.assertNotIn('card_webp', enabled)
+            self.assertIn('card_480', enabled)
+            thumbnails.generate(self.post.image.name, self.post.pk)
+            response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'image/webp')
+
+    def test_backfill_skips_fresh_and_resumes(self):
+        """ THUMBNAILS | backfill создаёт недостающие, пропускает готовые
+        и продолжает с checkpoint """
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'backfill.json')
+
+        def backfill(*args):
+            out = StringIO()
+            call_command(
+                'backfill_thumbnails', '--workers', '0',
+                '--checkpoint', checkpoint, *args, stdout=out
+            )
+            return out.getvalue()
+
+        self.assertIn('создано 2, актуальных 0', backfill('--chunk-size', '1'))
+        self.assertTrue(Post.objects.get(pk=self.other.pk).image_placeholder)
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertIn('создано 0, актуальных 2', backfill())
+
+        with open(checkpoint, 'w') as target:
+            json.dump({
+                'last_id': self.post.pk, 'signature': _signature(True)
+            }, target)
+        self.assertIn('создано 1, актуальных 0', backfill('--force'))
+
+    def test_draft_engine_matches_stock_engine(self):
+        """ THUMBNAILS | Быстрый движок даёт тот же размер и поворот, что
+        и стандартный, но декодирует JPEG уменьшенным """
+        photo = Image.new('RGB', (2400, 1200), 'white')
+        photo.paste((255, 0, 0), (0, 0, 600, 1200))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        buffer = BytesIO()
+        photo.save(buffer, 'JPEG', exif=exif)
+        name = default.storage.save(
+            'posts/rotated.jpg', SimpleUploadedFile('rotated.jpg',
+                                                    buffer.getvalue())
+        )
+        results = []
+        for engine in (pil_engine.Engine(), thumbnail_engine.Engine()):
+            source = ImageFile(name, default.storage)
+            options = thumbnails.backend.full_options(
+                source, {'upscale': True}
+            )
+            image = engine.get_image(source)
+            geometry = parse_geometry(
+                '200x200', engine.get_image_ratio(image, options)
+            )
+            results.append(engine.create(image, geometry, options))
+        stock, fast = results
+        self.assertEqual(fast.size, stock.size)
+        self.assertEqual(fast.size, (100, 200))
+        # После поворота на 90° красная полоса слева оказывается сверху.
+        red, green, _ = fast.convert('RGB').getpixel((50, 5))
+        self.assertGreater(red, 200)
+        self.assertLess(green, 60)
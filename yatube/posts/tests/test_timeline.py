@@ -0,0 +1,145 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+
+from posts.models import Follow, Post, TimelineEntry, UserStats
+from posts.timeline import follow_feed
+
+
+User = get_user_model()
+
+
+@override_settings(TIMELINE_LENGTH=3, TIMELINE_TRIM_EVERY=1)
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        Post.objects.bulk_create([
+            Post(author=cls.author, text=f'old post №{i}') for i in range(5)
+        ])
+
+    def feed(self):
+        entries = TimelineEntry.objects.filter(user=self.reader)
+        return list(entries.order_by('-pub_date', '-post_id').values_list(
+            'post_id', flat=True
+        ))
+
+    def test_follow_backfills_capped_feed(self):
+        """ TIMELINE | Подписка добавляет в ленту последние посты автора """
+        Follow.objects.create(user=self.reader, author=self.author)
+        newest = Post.objects.order_by('-pub_date', '-id').values_list(
+            'id', flat=True
+        )[:3]
+        self.assertEqual(self.feed(), list(newest))
+
+    def test_new_post_is_pushed_and_feed_trimmed(self):
+        """ TIMELINE | Новый пост попадает в ленту, лента обрезается """
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='fresh')
+        self.assertEqual(len(self.feed()), 3)
+        self.assertEqual(self.feed()[0], post.id)
+
+    def test_unfollow_prunes_feed(self):
+        """ TIMELINE | Отписка убирает посты автора из ленты """
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        follow.delete()
+        self.assertEqual(self.feed(), [])
+
+
+@override_settings(TIMELINE_CELEBRITY_FOLLOWERS=2, DEF_NUM_POSTS=3)
+class HybridTimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.fan = User.objects.create_user(username='fan')
+        cls.star = User.objects.create_user(username='star')
+        cls.author = User.objects.create_user(username='writer')
+        Follow.objects.create(user=cls.reader, author=cls.star)
+        Follow.objects.create(user=cls.fan, author=cls.star)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get('/follow/')
+
+    def test_celebrity_posts_are_pulled(self):
+        """ TIMELINE | Посты знаменитости подмешиваются при чтении """
+        posts = [
+            Post.objects.create(author=author, text=f'post №{i}')
+            for i, author in enumerate([self.star, self.author] * 3)
+        ]
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.star).exists()
+        )
+        page = follow_feed(self.reader, self.request)
+        self.assertEqual(list(page), posts[::-1][:3])
+
+        older = self.request.GET.copy()
+        older['cursor'] = page.paginator.older_cursor
+        self.request.GET = older
+        page = follow_feed(self.reader, self.request)
+        self.assertEqual(list(page), posts[::-1][3:])
+        self.assertFalse(page.has_next())
+
+    def test_page_number_is_honoured(self):
+        """ TIMELINE | Старые ссылки ?page=N открывают нумерованную
+        страницу ленты подписок """
+        posts = [
+            Post.objects.create(author=author, text=f'post №{i}')
+            for i, author in enumerate([self.star, self.author] * 6)
+        ]
+        self.request.GET = self.request.GET.copy()
+        self.request.GET['page'] = '2'
+        page = follow_feed(self.reader, self.request)
+        self.assertEqual((page.number, page.paginator.num_pages), (2, 2))
+        self.assertEqual(list(page), posts[::-1][10:])
+
+    def work(self):
+        call_command('run_workers', '--burst', '--threads', '0',
+                     stdout=StringIO())
+
+    def is_celebrity(self, user):
+        return UserStats.objects.get(user=user).celebrity
+
+    @override_settings(JOB_QUEUE_INLINE=False)
+    def test_demoted_author_posts_are_pushed(self):
+        """ TIMELINE | Посты, написанные знаменитостью, остаются в ленте,
+        когда подписчиков становится меньше порога """
+        post = Post.objects.create(author=self.star, text='для избранных')
+        self.assertEqual(list(follow_feed(self.reader, self.request)), [post])
+        Follow.objects.filter(user=self.fan, author=self.star).delete()
+        # До выполнения задачи посты по-прежнему читаются из потока.
+        self.assertTrue(self.is_celebrity(self.star))
+        self.assertEqual(list(follow_feed(self.reader, self.request)), [post])
+        self.work()
+        self.assertFalse(self.is_celebrity(self.star))
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+        self.assertEqual(list(follow_feed(self.reader, self.request)), [post])
+        newer = Post.objects.create(author=self.star, text='для всех')
+        self.assertEqual(
+            list(follow_feed(self.reader, self.request)), [newer, post]
+        )
+
+    @override_settings(TIMELINE_CELEBRITY_HYSTERESIS=0.5,
+                       JOB_QUEUE_INLINE=False)
+    def test_threshold_has_hysteresis(self):
+        """ TIMELINE | Автор у самого порога не переключается туда и
+        обратно на каждой подписке """
+        Follow.objects.filter(user=self.fan, author=self.star).delete()
+        self.work()
+        self.assertTrue(self.is_celebrity(self.star))
+        Follow.objects.filter(user=self.reader, author=self.star).delete()
+        self.work()
+        self.assertFalse(self.is_celebrity(self.star))
+        Follow.objects.create(user=self.reader, author=self.star)
+        self.assertFalse(self.is_celebrity(self.star))
+        Follow.objects.create(user=self.fan, author=self.star)
+        self.assertTrue(self.is_celebrity(self.star))
@@ -0,0 +1,117 @@
+import shutil
+import tempfile
+from http import HTTPStatus
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+from posts.uploads import HEADER_LIMIT, ImageUploadHandler
+
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def upload(self, content, client=None):
+        return (client or self.client).post(reverse('posts:post_create'), {
+            'text': 'post with upload',
+            'image': SimpleUploadedFile('upload.gif', content, 'image/gif'),
+        })
+
+    def test_valid_image_is_saved(self):
+        """ UPLOADS | Картинка в пределах лимитов сохраняется с постом """
+        response = self.upload(SMALL_GIF)
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        post = Post.objects.get(text='post with upload')
+        self.assertTrue(post.image.name.startswith('posts/'))
+
+    def test_limits_are_reported_in_form(self):
+        """ UPLOADS | Слишком большой файл, слишком много пикселей и не
+        картинка отклоняются с ошибкой у поля image """
+        cases = [
+            ({'POST_IMAGE_MAX_SIZE': 16}, SMALL_GIF, 'слишком большой'),
+            ({'POST_IMAGE_MAX_PIXELS': 1}, SMALL_GIF, 'мегапикселей'),
+            ({}, b'plain text, not a picture', 'правильное изображение'),
+        ]
+        for limits, content, message in cases:
+            with self.subTest(message=message), override_settings(**limits):
+                response = self.upload(content)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertIn(
+                    message, ' '.join(response.context['form'].errors['image'])
+                )
+        self.assertFalse(Post.objects.filter(text='post with upload').exists())
+
+    def test_request_over_limit_is_not_read(self):
+        """ UPLOADS | Запрос длиннее лимита отклоняется по Content-Length
+        с ошибкой в форме, хотя токен CSRF в непрочитанном теле """
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        url = reverse('posts:post_create')
+        token = client.get(url).context['csrf_token']
+        with override_settings(POST_IMAGE_MAX_SIZE=0,
+                               DATA_UPLOAD_MAX_MEMORY_SIZE=16):
+            response = client.post(url, {
+                'csrfmiddlewaretoken': str(token),
+                'text': 'post with upload',
+                'image': SimpleUploadedFile('upload.gif', SMALL_GIF,
+                                            'image/gif'),
+            })
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        form = response.context['form']
+        self.assertIn('слишком большой', ' '.join(form.errors['image']))
+        self.assertFalse(form.data)
+        self.assertFalse(Post.objects.filter(text='post with upload').exists())
+
+    def test_header_is_checked_on_first_chunks(self):
+        """ UPLOADS | Не-картинка отклоняется по первым кускам, не дожидаясь
+        конца файла """
+        handler = ImageUploadHandler()
+        handler.new_file('image', 'fake.gif', 'image/gif', None)
+        chunk = b'\0' * handler.chunk_size
+        with self.assertRaises(StopUpload):
+            for start in range(0, HEADER_LIMIT * 2, len(chunk)):
+                handler.receive_data_chunk(chunk, start)
+        self.assertLessEqual(start, HEADER_LIMIT)
+        self.assertIn('image', handler.errors)
+
+    def test_csrf_is_still_checked(self):
+        """ UPLOADS | Форма с картинкой по-прежнему требует CSRF-токен """
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = self.upload(SMALL_GIF, client)
+        self.assertTemplateUsed(response, 'core/403csrf.html')
+        self.assertFalse(Post.objects.filter(text='post with upload').exists())
@@ -1,6 +1,7 @@
 from http import HTTPStatus
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase, Client
 
 from posts.models import Post, Group
@@ -34,6 +35,7 @@ class PostURLTest(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         # неавторизованный клиент
         self.guest_client = Client()
 
@@ -1,4 +1,7 @@
+import re
 import tempfile
+import time
+from unittest import mock
 
 from django import forms
 from django.contrib.auth import get_user_model
@@ -6,9 +9,15 @@ from django.urls import reverse
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.http import HttpResponse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Post, Group, Follow
-from django.test import TestCase, Client, override_settings
+from posts import page_cache
+from posts.models import Comment, Post, Group, Follow
+from posts.utils import OLDER, encode_cursor, feed_count_key
+from django.test import (Client, RequestFactory, TestCase,
+                         override_settings)
 
 
 User = get_user_model()
@@ -19,6 +28,9 @@ num_objects_created = 1
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
+USER_HEADER = re.compile(r'Пользователь: (\w+)')
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostViewsTest(TestCase):
@@ -111,28 +123,147 @@ class PostViewsTest(TestCase):
 
     def test_index_cache(self):
         "VIEWS | Тестируем кэш"
+        cached_response = self.guest_client.get(reverse('posts:index'))
+        with self.assertNumQueries(0):
+            repeated_response = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(cached_response.content, repeated_response.content)
+
         Post.objects.create(
             text='post for deletion',
             author=self.user,
             group=self.group,
         )
+        after_creation = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(after_creation, 'post for deletion')
 
-        cached_response = self.guest_client.get(reverse('posts:index'))
         Post.objects.filter(text='post for deletion').delete()
-
-        cache_after_deletion = self.guest_client.get(reverse('posts:index'))
-        self.assertEqual(
-            cached_response.content,
-            cache_after_deletion.content
+        after_deletion = self.guest_client.get(reverse('posts:index'))
+        self.assertNotContains(after_deletion, 'post for deletion')
+
+    def test_cached_pages_are_per_user(self):
+        "VIEWS | Страница из кэша не достаётся другому пользователю"
+        pages = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': self.user2}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:group', kwargs={'slug': self.group.slug}),
+            reverse('posts:search') + '?q=text',
+        ]
+        for url in pages:
+            with self.subTest(url=url):
+                cache.clear()
+                own = self.authorized_client.get(url)
+                other = self.authorized_author.get(url)
+                self.assertEqual(
+                    [USER_HEADER.findall(page.content.decode())
+                     for page in (own, other)],
+                    [[self.user.username], [self.user2.username]],
+                )
+                for token in CSRF_INPUT.findall(own.content.decode()):
+                    self.assertNotContains(other, token)
+                guest = self.guest_client.get(url)
+                self.assertNotContains(guest, 'Пользователь:')
+
+    def test_detail_cache_follows_comments(self):
+        "VIEWS | Кэш страницы поста сбрасывается новым комментарием"
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.guest_client.get(url)
+        self.post.comments.create(author=self.user2, text='fresh comment')
+        self.assertContains(self.guest_client.get(url), 'fresh comment')
+
+    def test_stale_page_while_other_request_rebuilds(self):
+        "VIEWS | Устаревшую страницу собирает один запрос, другим - копия"
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        # update() без сигналов: версия страницы та же, изменился бы
+        # только пересобранный HTML.
+        Post.objects.filter(pk=self.post.pk).update(text='changed quietly')
+        clock = mock.Mock(wraps=time)
+        clock.time.return_value = (
+            time.time() + settings.PAGE_CACHE_TIMEOUT + 1
         )
-
+        with mock.patch('posts.page_cache.time', clock):
+            with mock.patch.object(page_cache.PageCacheMiddleware, '_lock',
+                                   return_value=False):
+                with self.assertNumQueries(0):
+                    stale = self.guest_client.get(url)
+            self.assertNotContains(stale, 'changed quietly')
+            self.assertContains(self.guest_client.get(url), 'changed quietly')
+
+    def test_protected_cache_page_varies_on_cookie(self):
+        "VIEWS | Защищённый кэш страниц сам разделяет копии по кукам"
+        view = page_cache.protected_cache_page(60, key_prefix='vary')(
+            lambda request: HttpResponse(request.COOKIES['sessionid'])
+        )
+        for session in ('alice', 'bob', 'alice'):
+            request = RequestFactory().get(
+                '/vary/', HTTP_COOKIE=f'sessionid={session}'
+            )
+            self.assertEqual(view(request).content, session.encode())
+
+    def test_stale_page_is_not_served_to_other_user(self):
+        "VIEWS | Устаревшая копия одного пользователя не достаётся другому"
+        url = reverse('posts:index')
+        self.authorized_client.get(url)
+        clock = mock.Mock(wraps=time)
+        clock.time.return_value = (
+            time.time() + settings.PAGE_CACHE_TIMEOUT + 1
+        )
+        with mock.patch('posts.page_cache.time', clock), \
+                mock.patch.object(page_cache.PageCacheMiddleware, '_lock',
+                                  return_value=False), \
+                self.settings(PAGE_CACHE_WAIT=0):
+            other = self.authorized_author.get(url)
+        self.assertEqual(USER_HEADER.findall(other.content.decode()),
+                         [self.user2.username])
+
+    def test_miss_waits_for_page_built_by_other_request(self):
+        "VIEWS | Без копии запрос ждёт страницу, которую собирает другой"
+        url = reverse('posts:index')
+        built = self.guest_client.get(url)
+        cached = page_cache.PageCacheMiddleware._cached
+        lookups = []
+
+        def not_yet_built(middleware, request):
+            lookups.append(request)
+            return None if len(lookups) == 1 else cached(middleware, request)
+        with mock.patch.object(page_cache.PageCacheMiddleware, '_cached',
+                               autospec=True, side_effect=not_yet_built), \
+                mock.patch.object(page_cache.PageCacheMiddleware, '_lock',
+                                  return_value=False), \
+                mock.patch('posts.page_cache.time.sleep') as sleep, \
+                self.assertNumQueries(0):
+            response = self.guest_client.get(url)
+        sleep.assert_called_once()
+        self.assertEqual(response.content, built.content)
         cache.clear()
-
-        content_after_clearing = self.guest_client.get(reverse('posts:index'))
-        self.assertNotEqual(
-            cached_response.content,
-            content_after_clearing.content
+        with self.settings(PAGE_CACHE_WAIT=0), \
+                mock.patch.object(page_cache.PageCacheMiddleware, '_lock',
+                                  return_value=False):
+            self.assertContains(self.guest_client.get(url), self.post.text)
+
+    def test_early_refresh_probability(self):
+        "VIEWS | XFetch: долгая сборка и близкий срок - обновить раньше"
+        soon = time.time() + 10
+        with mock.patch('posts.page_cache.random.random', return_value=0.5):
+            self.assertFalse(page_cache.refresh_early(soon, 1, 1))
+            self.assertTrue(page_cache.refresh_early(soon, 20, 1))
+        with mock.patch('posts.page_cache.random.random',
+                        return_value=1 - 1e-6):
+            self.assertTrue(page_cache.refresh_early(soon, 1, 1))
+
+    def test_page_versions_expire(self):
+        """ VIEWS | Версии областей из адреса не живут в кэше вечно """
+        url = reverse('posts:post_detail', kwargs={'post_id': 10 ** 6})
+        self.guest_client.get(url)
+        version = page_cache.get_versions([f'post:{10 ** 6}'])
+        later = time.time() + (
+            settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_STALE + 1
         )
+        with mock.patch('core.cache.time.time', return_value=later):
+            self.assertNotEqual(
+                page_cache.get_versions([f'post:{10 ** 6}']), version
+            )
 
     def test_profile_content(self):
         """ VIEW | Тестируем контент в context на странице profile """
@@ -180,6 +311,110 @@ class PostViewsTest(TestCase):
         )
         self.assertEqual(first_object.image, self.post.image)
 
+    def test_post_detail_queries_do_not_grow(self):
+        """ VIEW | Число запросов страницы поста не зависит от комментариев """
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+
+        def comment_and_count(number):
+            for i in range(number):
+                commenter = User.objects.create(username=f'c{number}_{i}')
+                Comment.objects.create(
+                    post=self.post, author=commenter, text='hi'
+                )
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.guest_client.get(url)
+            return response, len(queries)
+
+        # Первый показ создаёт миниатюру картинки, это отдельные запросы
+        comment_and_count(0)
+        _, few = comment_and_count(3)
+        response, many = comment_and_count(30)
+        self.assertEqual(few, many)
+        self.assertEqual(
+            len(response.context['comments']), settings.COMMENTS_PER_PAGE
+        )
+
+    def test_comments_api_pages(self):
+        """ VIEW | API комментариев листается курсором """
+        Comment.objects.bulk_create([
+            Comment(post=self.post, author=self.user, text=f'c{i}')
+            for i in range(settings.COMMENTS_PER_PAGE + 5)
+        ])
+        url = reverse('posts:post_comments', kwargs={'pk': self.post.pk})
+        first = self.guest_client.get(url).json()
+        self.assertEqual(len(first['results']), settings.COMMENTS_PER_PAGE)
+        self.assertEqual(first['results'][0]['author'], self.user.username)
+        older = self.guest_client.get(url, {'cursor': first['older']}).json()
+        self.assertEqual(len(older['results']), 5)
+        self.assertIsNone(older['older'])
+
+    def test_posts_api_pages_and_fields(self):
+        """ VIEW | API постов: курсор, фильтр и выбор полей """
+        url = reverse('posts:posts_api')
+        first = self.guest_client.get(
+            url, {'limit': 10, 'group': self.group.slug, 'fields': 'id,group'}
+        ).json()
+        self.assertEqual(len(first['results']), 10)
+        self.assertEqual(first['results'][0], {
+            'id': self.post.id, 'group': self.group.slug
+        })
+        older = self.guest_client.get(
+            url, {'limit': 10, 'cursor': first['older']}
+        ).json()
+        self.assertEqual(len(older['results']), posts_second_page)
+        self.assertEqual(older['results'][0]['author'], self.user.username)
+
+    def test_posts_api_rejects_bad_since(self):
+        """ VIEW | API постов отвечает 400 на невозможную дату since """
+        url = reverse('posts:posts_api')
+        for since in ('yesterday', '2024-13-01T00:00', '2024-02-30T00:00'):
+            with self.subTest(since=since):
+                response = self.guest_client.get(url, {'since': since})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('since', response.json()['error'])
+
+    def test_posts_api_ids(self):
+        """ VIEW | API постов отдаёт пачку по ids в порядке запроса """
+        other = Post.objects.exclude(pk=self.post.pk).first()
+        ids = [self.post.id, other.id, 0]
+        response = self.guest_client.get(
+            reverse('posts:posts_api'),
+            {'ids': ','.join(map(str, ids)), 'fields': 'id,text'}
+        )
+        self.assertEqual(
+            [row['id'] for row in response.json()['results']], ids[:2]
+        )
+
+    def test_pages_answer_not_modified(self):
+        """ VIEW | Страницы отдают ETag и 304 для актуальной копии """
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        # Первый ответ выставляет куки, от которых тоже зависит ETag.
+        self.guest_client.get(url)
+        etag = self.guest_client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.post.comments.create(author=self.user2, text='new comment')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_post_api_conditional_get(self):
+        """ VIEW | API поста: ETag, Last-Modified и 304 """
+        url = reverse('posts:post_ser', kwargs={'pk': self.post.pk})
+        response = self.guest_client.get(url)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'edited text'
+        post.save()
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['text'], 'edited text')
+
     def test_new_post_context(self):
         """ Страница НОВОГО поста с правильным контекстом."""
         response = self.authorized_client.get(reverse('posts:post_create'))
@@ -258,6 +493,56 @@ class PostViewsTest(TestCase):
         )
         self.assertEqual(len(response.context['page_obj']), posts_second_page)
 
+    def test_index_cursor_pages(self):
+        """ VIEW | Листание index курсорами новее/старее """
+        response = self.client.get(reverse('posts:index'))
+        first_page = list(response.context['page_obj'])
+        paginator = response.context['page_obj'].paginator
+        self.assertIsNone(paginator.newer_cursor)
+
+        response = self.client.get(
+            reverse('posts:index') + f'?cursor={paginator.older_cursor}'
+        )
+        older_page = response.context['page_obj']
+        self.assertEqual(len(older_page), posts_second_page)
+        self.assertIsNone(older_page.paginator.older_cursor)
+        self.assertTrue(older_page.has_previous())
+
+        response = self.client.get(
+            reverse('posts:index')
+            + f'?cursor={older_page.paginator.newer_cursor}'
+        )
+        self.assertEqual(list(response.context['page_obj']), first_page)
+
+    def test_broken_cursor_shows_first_page(self):
+        """ VIEW | Битый курсор открывает первую страницу """
+        response = self.client.get(reverse('posts:index') + '?cursor=xyz')
+        self.assertEqual(len(response.context['page_obj']), posts_first_page)
+        null = encode_cursor(OLDER, [None, None])
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:group', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:posts_api'),
+            reverse('posts:post_comments', kwargs={'pk': self.post.pk}),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'cursor': null})
+                self.assertEqual(response.status_code, 200)
+
+    def test_feed_count_is_cached(self):
+        """ VIEW | Число постов ленты кэшируется и сбрасывается сигналом """
+        key = feed_count_key('group', self.group.id)
+        response = self.client.get(
+            reverse('posts:group', kwargs={'slug': self.group.slug})
+            + '?page=2'
+        )
+        paginator = response.context['page_obj'].paginator
+        self.assertEqual(cache.get(key), paginator.count)
+        self.assertEqual(list(paginator.page_window), [1, 2])
+        Post.objects.create(text='new', author=self.user, group=self.group)
+        self.assertIsNone(cache.get(key))
+
     def test_subscribe(self):
         """ VIEWS | Тестируем подписку """
         self.authorized_client.get(
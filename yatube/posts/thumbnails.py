@@ -0,0 +1,241 @@
+"""Миниатюры картинок постов вне пути запроса.
+
+Шаблоны только ищут готовую миниатюру в key-value хранилище sorl и,
+если её ещё нет, показывают оригинал. Сами миниатюры всех геометрий из
+POST_THUMBNAILS создаёт фоновая задача core.jobs, поставленная вместе
+с сохранением поста с картинкой; она же записывает в пост размеры
+картинки и крошечный placeholder для карточки.
+"""
+import base64
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageOps
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from core import jobs
+
+from . import page_cache
+from .models import Post
+
+EXIF_ORIENTATION = 0x0112
+
+
+class LookupBackend(ThumbnailBackend):
+    """Бэкенд sorl, который умеет найти миниатюру, не создавая её."""
+
+    def full_options(self, source, options):
+        # Те же опции по умолчанию, что и в ThumbnailBackend.get_thumbnail,
+        # иначе имя файла миниатюры не совпадёт с созданным.
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        options = self.full_options(source, options)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def lookup(self, file_, geometry_string, **options):
+        """Готовая миниатюра или None; картинку не открывает."""
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options)
+        )
+
+
+backend = LookupBackend()
+
+
+def enabled_thumbnails():
+    """POST_THUMBNAILS без вариантов в форматах, которые Pillow не пишет.
+
+    Например, WebP доступен, только если Pillow собран с libwebp.
+    """
+    Image.init()
+    return {
+        alias: (geometry, options)
+        for alias, (geometry, options) in settings.POST_THUMBNAILS.items()
+        if options.get('format', 'JPEG').upper() in Image.SAVE
+    }
+
+
+def prefetch(posts):
+    """Находит все миниатюры картинок постов страницы одним multi-get.
+
+    URL (или None, если миниатюры ещё нет) запоминаются на самих файлах
+    картинок, и шаблонные теги берут их оттуда без обращения к хранилищу.
+    """
+    images = [post.image for post in posts if post.image]
+    if not images:
+        return
+    files = {
+        (image.name, alias): backend.thumbnail_file(
+            image.name, geometry, **options
+        )
+        for image in images
+        for alias, (geometry, options) in enabled_thumbnails().items()
+    }
+    found = default.kvstore.get_many(files.values())
+    for image in images:
+        urls = image.__dict__.setdefault('_thumbnail_urls', {})
+        for alias in enabled_thumbnails():
+            thumbnail = found.get(files[image.name, alias].key)
+            urls[alias] = thumbnail.url if thumbnail else None
+
+
+def ready_url(image, alias):
+    """URL готовой миниатюры `alias` или None."""
+    prefetched = getattr(image, '_thumbnail_urls', {})
+    if alias in prefetched:
+        return prefetched[alias]
+    if alias not in enabled_thumbnails():
+        return None
+    geometry, options = settings.POST_THUMBNAILS[alias]
+    thumbnail = backend.lookup(image.name, geometry, **options)
+    return thumbnail.url if thumbnail else None
+
+
+def picture(post):
+    """Контекст <picture> карточки поста: srcset готовых вариантов по
+    MIME-типам, размеры и placeholder; без вариантов - только оригинал.
+
+    width и height - размеры той картинки, на которую указывает тег:
+    кадра POST_CARD_SIZE или сохранённые размеры оригинала.
+    """
+    image = post.image
+    if not hasattr(image, '_thumbnail_urls'):
+        prefetch([post])
+    srcsets = []
+    for content_type, candidates in settings.POST_CARD_SRCSET.items():
+        srcset = ', '.join(
+            f'{url} {width}w' for url, width in (
+                (ready_url(image, alias), width)
+                for alias, width in candidates
+            ) if url
+        )
+        if srcset:
+            srcsets.append((content_type, srcset))
+    card = ready_url(image, 'card')
+    if card or srcsets:
+        # Браузер возьмёт кадрированный вариант из src или srcset.
+        width, height = settings.POST_CARD_SIZE
+    else:
+        # Оригинал в своих пропорциях; пока фоновая задача не записала
+        # размеры, их лучше не указывать, чем указать неверные.
+        width, height = post.image_width, post.image_height
+    return {
+        'src': card or image.url,
+        # Последний тип - запасной для <img>, остальные идут в <source>.
+        'sources': srcsets[:-1],
+        'srcset': srcsets[-1][1] if srcsets else '',
+        'width': width,
+        'height': height,
+        'placeholder': post.image_placeholder,
+    }
+
+
+def image_meta(name):
+    """Размеры картинки с учётом EXIF-поворота и placeholder для неё.
+
+    Placeholder - крошечный JPEG в пропорциях карточки в виде data URI:
+    он встраивается в страницу и растягивается, пока грузится картинка.
+    """
+    width, height = settings.POST_CARD_SIZE
+    size = (
+        settings.POST_PLACEHOLDER_WIDTH,
+        max(1, round(settings.POST_PLACEHOLDER_WIDTH * height / width)),
+    )
+    with default.storage.open(name) as source:
+        image = Image.open(source)
+        original = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            original = original[::-1]
+        image.draft('RGB', (size[0] * 8, size[1] * 8))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        buffer = BytesIO()
+        ImageOps.fit(image, size, Image.LANCZOS).save(
+            buffer, 'JPEG', quality=40
+        )
+    placeholder = base64.b64encode(buffer.getvalue()).decode()
+    return original + (f'data:image/jpeg;base64,{placeholder}',)
+
+
+def save_meta(post_id, name):
+    """Сохраняет размеры и placeholder картинки поста.
+
+    update() не трогает `edited` и не вызывает сигналы сохранения поста.
+    """
+    # Одинаковые картинки хранятся одним файлом: размеры могли уже
+    # посчитать для другого поста с ней.
+    width, height, placeholder = Post.objects.filter(image=name).exclude(
+        image_placeholder=''
+    ).values_list(
+        'image_width', 'image_height', 'image_placeholder'
+    ).first() or image_meta(name)
+    Post.objects.filter(pk=post_id, image=name).update(
+        image_width=width, image_height=height,
+        image_placeholder=placeholder,
+    )
+
+
+def generate(name, post_id=None):
+    """Создаёт все миниатюры картинки и сохраняет её размеры в пост.
+
+    Страницы с постом уже могли попасть в кэш со ссылкой на оригинал,
+    поэтому после генерации их версии повышаются. Ошибки не глушатся:
+    очередь задач повторит генерацию позже.
+    """
+    if not default.storage.exists(name):
+        return
+    for geometry, options in enabled_thumbnails().values():
+        backend.get_thumbnail(name, geometry, **options)
+    if post_id is not None:
+        save_meta(post_id, name)
+    post = Post.objects.select_related('author').filter(pk=post_id).first()
+    if post is not None:
+        page_cache.bump_post_pages(post, post.group_id)
+
+
+def rebuild(name, force=False):
+    """Досоздаёт устаревшие миниатюры картинки и возвращает их число.
+
+    Миниатюра актуальна, если она есть в хранилище ключей и её файл на
+    месте. Запись без файла (например, после восстановления media из
+    копии) удаляется: иначе sorl вернул бы её, ничего не создав.
+    """
+    if not default.storage.exists(name):
+        raise FileNotFoundError(name)
+    built = 0
+    for geometry, options in enabled_thumbnails().values():
+        thumbnail = backend.thumbnail_file(name, geometry, **options)
+        cached = default.kvstore.get(thumbnail)
+        if cached is not None and not force and cached.exists():
+            continue
+        if cached is not None:
+            default.kvstore.delete(cached, delete_thumbnails=False)
+        if force and thumbnail.exists():
+            thumbnail.delete()
+        backend.get_thumbnail(name, geometry, **options)
+        built += 1
+    return built
+
+
+def schedule(post):
+    """Ставит миниатюры картинки поста в очередь фоновых задач."""
+    if post.image:
+        jobs.enqueue(
+            generate, post.image.name, post.pk,
+            dedupe_key=f'thumbnails:{post.pk}:{post.image.name}',
+        )
@@ -0,0 +1,265 @@
+import heapq
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from core import jobs
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .utils import NEWER, KeysetPaginator, fetch_window, paginator
+
+CELEBRITIES_KEY = 'timeline:celebrities'
+
+
+def celebrity_ids():
+    """Авторы, чьи посты не раздаются подписчикам, а подмешиваются при чтении.
+
+    Это флаг UserStats.celebrity, см. reclassify(); множество читается
+    из базы не чаще раза в CELEBRITIES_TIMEOUT секунд. Запись решает по
+    самому флагу: по устаревшему множеству лента только временно
+    читает лишний поток или не видит новых постов нового автора.
+    """
+    def load():
+        return set(UserStats.objects.filter(
+            celebrity=True
+        ).values_list('user_id', flat=True))
+    return cache.get_or_set(
+        CELEBRITIES_KEY, load, settings.CELEBRITIES_TIMEOUT
+    )
+
+
+def demote_below():
+    return settings.TIMELINE_CELEBRITY_FOLLOWERS * (
+        1 - settings.TIMELINE_CELEBRITY_HYSTERESIS
+    )
+
+
+def reclassify(author_ids=None):
+    """Переводит авторов между раздачей и чтением по числу подписчиков.
+
+    Знаменитостью автор становится от TIMELINE_CELEBRITY_FOLLOWERS
+    подписчиков, а обратно переходит, только когда их стало меньше на
+    TIMELINE_CELEBRITY_HYSTERESIS, чтобы не переключаться на каждой
+    подписке у порога. Уже разосланные посты остаются в лентах, а
+    нераздававшиеся при понижении раздаёт задача demote().
+    """
+    stats = UserStats.objects.all()
+    if author_ids is not None:
+        stats = stats.filter(user_id__in=author_ids)
+    promoted = stats.filter(
+        celebrity=False,
+        followers_count__gte=settings.TIMELINE_CELEBRITY_FOLLOWERS,
+    ).update(celebrity=True)
+    demoted = stats.filter(
+        celebrity=True, followers_count__lt=demote_below()
+    ).values_list('user_id', flat=True)
+    for author_id in demoted:
+        jobs.enqueue(demote, author_id, dedupe_key=f'demote:{author_id}')
+    if promoted:
+        cache.delete(CELEBRITIES_KEY)
+
+
+def demote(author_id):
+    """Фоновая задача: раздаёт последние посты бывшей знаменитости.
+
+    Флаг снимается в той же транзакции, что и раздача: до её конца
+    новые посты автора не раздаются, а ленты читают его поток, после -
+    посты уже лежат в лентах подписчиков.
+    """
+    with transaction.atomic():
+        if not UserStats.objects.filter(
+            user_id=author_id,
+            celebrity=True,
+            followers_count__lt=demote_below(),
+        ).update(celebrity=False):
+            return
+        posts = list(Post.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        ).only('id', 'author_id', 'pub_date')[:settings.TIMELINE_LENGTH])
+        follower_ids = Follow.objects.filter(
+            author_id=author_id
+        ).values_list('user_id', flat=True)
+        for user_id in list(follower_ids):
+            TimelineEntry.objects.bulk_create(
+                [entry for post in posts
+                 for entry in _entries([user_id], post)],
+                ignore_conflicts=True,
+            )
+            trim(user_id)
+    cache.delete(CELEBRITIES_KEY)
+
+
+def _is_celebrity(author_id):
+    return UserStats.objects.filter(
+        user_id=author_id, celebrity=True
+    ).exists()
+
+
+def _entries(user_ids, post):
+    return [
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post.id,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in user_ids
+    ]
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты всех подписчиков автора.
+
+    У автора с числом подписчиков больше TIMELINE_FANOUT_INLINE
+    раздачу делает фоновая задача, а не запрос, создавший пост.
+    """
+    followers, celebrity = UserStats.objects.filter(
+        user_id=post.author_id
+    ).values_list('followers_count', 'celebrity').first() or (0, False)
+    if celebrity:
+        return
+    if followers > settings.TIMELINE_FANOUT_INLINE:
+        jobs.enqueue(fan_out_post, post.pk, dedupe_key=f'fan_out:{post.pk}')
+        return
+    _deliver(post)
+
+
+def fan_out_post(post_id):
+    """Фоновая раздача поста; удалённый к этому времени пост пропускается."""
+    post = Post.objects.filter(pk=post_id).only(
+        'id', 'author_id', 'pub_date'
+    ).first()
+    if post is not None:
+        _deliver(post)
+
+
+def _deliver(post):
+    follower_ids = list(
+        Follow.objects.filter(
+            author_id=post.author_id
+        ).values_list('user_id', flat=True)
+    )
+    TimelineEntry.objects.bulk_create(
+        _entries(follower_ids, post), ignore_conflicts=True
+    )
+    # Обрезка амортизирована: каждый раз проверяется примерно
+    # 1/TIMELINE_TRIM_EVERY подписчиков, лента превышает лимит
+    # в среднем не больше чем на TIMELINE_TRIM_EVERY записей.
+    for user_id in follower_ids:
+        if random.randrange(settings.TIMELINE_TRIM_EVERY) == 0:
+            trim(user_id)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки."""
+    if _is_celebrity(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).only('id', 'author_id', 'pub_date')[:settings.TIMELINE_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [entry for post in posts for entry in _entries([user_id], post)],
+        ignore_conflicts=True,
+    )
+    trim(user_id)
+
+
+def rebuild(user_id):
+    """Собирает ленту заново из последних постов всех подписок.
+
+    Нужна после массовой загрузки в обход сигналов: три запроса на
+    пользователя вместо backfill на каждую подписку.
+    """
+    author_ids = Follow.objects.filter(user_id=user_id).exclude(
+        author_id__in=UserStats.objects.filter(
+            celebrity=True
+        ).values('user_id')
+    ).values('author_id')
+    posts = Post.objects.filter(author_id__in=author_ids).order_by(
+        '-pub_date', '-id'
+    ).only('id', 'author_id', 'pub_date')[:settings.TIMELINE_LENGTH]
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    TimelineEntry.objects.bulk_create(
+        [entry for post in posts for entry in _entries([user_id], post)]
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def trim(user_id):
+    """Обрезает ленту до TIMELINE_LENGTH самых свежих записей."""
+    cutoff = TimelineEntry.objects.filter(user_id=user_id).order_by(
+        '-pub_date', '-post_id'
+    ).values_list('pub_date', 'post_id')[settings.TIMELINE_LENGTH:].first()
+    if cutoff is None:
+        return
+    pub_date, post_id = cutoff
+    TimelineEntry.objects.filter(user_id=user_id).filter(
+        Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, post_id__lte=post_id)
+    ).delete()
+
+
+class FollowFeedPaginator(KeysetPaginator):
+    """Лента подписок: k-way merge разосланной ленты и постов знаменитостей.
+
+    Обычные авторы уже лежат в TimelineEntry пользователя, а посты
+    знаменитостей читаются отдельным потоком на каждого автора по
+    индексу (author, -pub_date). Все потоки отсортированы по
+    (pub_date, id), поэтому страница собирается `heapq.merge` без
+    общей сортировки.
+    """
+
+    def __init__(self, user, per_page):
+        # object_list нужен только базовому классу для разбора курсора.
+        super().__init__(Post.objects.all(), per_page)
+        self.user = user
+
+    def _fetch(self, direction, position, limit):
+        entries = TimelineEntry.objects.filter(
+            user=self.user
+        ).select_related('post__author', 'post__group')
+        streams = [(
+            entry.post for entry in fetch_window(
+                entries, ('pub_date', 'post_id'), direction, position, limit
+            )
+        )]
+        celebrities = Follow.objects.filter(
+            user=self.user, author_id__in=celebrity_ids()
+        ).values_list('author_id', flat=True)
+        for author_id in celebrities:
+            posts = Post.objects.filter(
+                author_id=author_id
+            ).select_related('author', 'group')
+            streams.append(fetch_window(
+                posts, self.keys, direction, position, limit
+            ))
+        merged = heapq.merge(
+            *streams,
+            key=lambda post: tuple(self.key_of(post)),
+            reverse=direction != NEWER,
+        )
+        rows, seen = [], set()
+        for post in merged:
+            if post.id not in seen:
+                seen.add(post.id)
+                rows.append(post)
+                if len(rows) == limit:
+                    break
+        return rows
+
+
+def follow_feed(user, request):
+    if request.GET.get('page') is not None:
+        # Номер страницы - старые ссылки: OFFSET по подпискам напрямую.
+        posts = Post.objects.filter(
+            author__following__user=user
+        ).select_related('author', 'group')
+        return paginator(posts, request)
+    feed = FollowFeedPaginator(user, settings.DEF_NUM_POSTS)
+    return feed.get_page(request.GET.get('cursor'))
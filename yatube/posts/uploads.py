@@ -0,0 +1,158 @@
+"""Потоковая загрузка картинок постов с ограничениями по ходу чтения.
+
+Стандартные обработчики Django целиком складывают файл в память или во
+временный файл, и только потом форма отдаёт его Pillow. Здесь файл сразу
+пишется на диск, а размер, формат и число пикселей проверяются по мере
+поступления данных: по заголовку запроса, по первым кускам файла и по
+числу записанных байт. Неподходящая загрузка прерывается, не дочитывая
+тело запроса, а ошибка показывается в форме у поля картинки.
+"""
+from functools import wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.template.defaultfilters import filesizeformat
+from django.utils.datastructures import MultiValueDict
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+# Сколько начала файла держать в памяти, пока Pillow не разберёт
+# заголовок: у JPEG перед размерами могут идти несколько блоков EXIF.
+HEADER_LIMIT = 256 * 1024
+
+
+def body_limit():
+    """Наибольшее тело запроса: картинка и остальные поля формы."""
+    return (
+        settings.POST_IMAGE_MAX_SIZE + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    )
+
+
+def too_large_body(request):
+    if not request.content_type.startswith('multipart/'):
+        return False
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0) > body_limit()
+    except ValueError:
+        return False
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """Пишет файлы во временный файл, проверяя их на лету.
+
+    Причина отказа попадает в `request.upload_errors` по имени поля.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.errors = {}
+        if request is not None:
+            request.upload_errors = self.errors
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        if content_length > body_limit():
+            # Тело не читается вовсе: форма получит пустые данные.
+            self.errors['image'] = self.too_large()
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = TemporaryUploadedFile(
+            self.file_name, self.content_type, 0, self.charset,
+            self.content_type_extra,
+        )
+        self.head = b''
+        self.checked = False
+        if (self.content_length or 0) > settings.POST_IMAGE_MAX_SIZE:
+            self.reject(self.too_large())
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.POST_IMAGE_MAX_SIZE:
+            self.reject(self.too_large())
+        if not self.checked:
+            self.head += raw_data
+            self.check_header(final=len(self.head) >= HEADER_LIMIT)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            # Весь файл короче HEADER_LIMIT, и Pillow его так и не узнал;
+            # тело уже дочитано, поэтому поле просто пропускается.
+            try:
+                self.check_header(final=True)
+            except StopUpload:
+                self.file.close()
+                return None
+        self.head = b''
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def check_header(self, final):
+        """Проверяет формат и размеры по началу файла.
+
+        Пока данных не хватает, Pillow не узнаёт картинку; ошибкой это
+        становится, только если её не узнать и по `final` куску.
+        """
+        try:
+            with Image.open(BytesIO(self.head)) as image:
+                format_, (width, height) = image.format, image.size
+        except Exception:
+            if final:
+                self.reject(
+                    'Загрузите правильное изображение. Файл, который вы '
+                    'загрузили, поврежден или не является изображением.'
+                )
+            return
+        self.checked = True
+        if format_ not in FORMATS:
+            self.reject(
+                f'Формат {format_} не поддерживается, загрузите '
+                f'{", ".join(sorted(FORMATS))}.'
+            )
+        if width * height > settings.POST_IMAGE_MAX_PIXELS:
+            self.reject(
+                f'Изображение {width}x{height} слишком большое: не больше '
+                f'{settings.POST_IMAGE_MAX_PIXELS // 10**6} мегапикселей.'
+            )
+
+    def reject(self, message):
+        self.errors[self.field_name] = message
+        raise StopUpload(connection_reset=True)
+
+    def too_large(self):
+        return (
+            'Файл слишком большой: не больше '
+            f'{filesizeformat(settings.POST_IMAGE_MAX_SIZE)}.'
+        )
+
+
+def image_upload(view):
+    """Подключает ImageUploadHandler к view с формой картинки.
+
+    Обработчики нельзя заменить после чтения request.POST, а его читает
+    CsrfViewMiddleware, поэтому view исключается из middleware и
+    проверяется csrf_protect уже после замены обработчиков.
+
+    Тело длиннее лимита не читается вовсе, и токена CSRF в нём не
+    найти: такой запрос сразу получает форму с ошибкой без проверки.
+    Это безопасно, пока view с пустыми данными ничего не меняет -
+    форма с ошибкой у картинки не проходит is_valid().
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [ImageUploadHandler(request)]
+        if request.method == 'POST' and too_large_body(request):
+            return view(request, *args, **kwargs)
+        return protected(request, *args, **kwargs)
+    return wrapper
@@ -8,6 +8,7 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('group/<slug:slug>/', views.group_posts, name='group'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('search/', views.search, name='search'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
@@ -27,5 +28,13 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('api/v1/posts/', views.posts_api, name='posts_api'),
     path('api/v1/posts/<int:pk>/', views.get_post, name='post_ser'),
+    path(
+        'api/v1/posts/<int:pk>/comments/',
+        views.get_comments,
+        name='post_comments'
+    ),
+    path('api/v1/search/', views.search_api, name='search_api'),
+    path('api/v1/export/', views.posts_export, name='posts_export'),
 ]
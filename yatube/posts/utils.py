@@ -1,9 +1,206 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from yatube.settings import (COMMENTS_PER_PAGE, DEF_NUM_POSTS,
+                             FEED_COUNT_TIMEOUT, PAGE_WINDOW)
+
+from .models import Group
+
+GROUP_CHOICES_KEY = 'group_choices'
+
+OLDER = 'older'
+NEWER = 'newer'
+
+
+def _cursor_value(value):
+    # Полная точность: DjangoJSONEncoder обрезает время до миллисекунд.
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not a cursor value')
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, *values], default=_cursor_value)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (направление, значения ключа) или None для мусора."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, *values = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if direction not in (OLDER, NEWER):
+        return None
+    return direction, values
+
+
+class KeysetPaginator(Paginator):
+    """Постраничный вывод по ключу `keys` в порядке убывания.
+
+    Вместо COUNT(*) и OFFSET каждая страница - это один запрос
+    `WHERE key < last ORDER BY key DESC LIMIT per_page + 1`, поэтому
+    стоимость страницы не зависит от размера таблицы и глубины листания.
+    Навигация - непрозрачные курсоры `newer_cursor`/`older_cursor`.
+    Страница остаётся обычным `Page`: номер 2 означает "есть новее",
+    последняя страница - "старее ничего нет".
+    """
+    is_keyset = True
+
+    def __init__(self, object_list, per_page, keys=('pub_date', 'id')):
+        super().__init__(object_list, per_page)
+        self.keys = keys
+        self.newer_cursor = None
+        self.older_cursor = None
+
+    def get_page(self, cursor):
+        decoded = decode_cursor(cursor)
+        if decoded is not None:
+            try:
+                direction, values = decoded
+                position = self._to_python(values)
+            except (ValidationError, ValueError, TypeError):
+                decoded = None
+        if decoded is None:
+            direction, position = OLDER, None
+        rows = self._fetch(direction, position, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == NEWER:
+            rows.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = position is not None, has_more
+        if rows and has_newer:
+            self.newer_cursor = encode_cursor(NEWER, self.key_of(rows[0]))
+        if rows and has_older:
+            self.older_cursor = encode_cursor(OLDER, self.key_of(rows[-1]))
+        number = 2 if self.newer_cursor else 1
+        self.num_pages = number + (1 if self.older_cursor else 0)
+        self.count = len(rows)
+        return self._get_page(rows, number, self)
+
+    def key_of(self, obj):
+        if isinstance(obj, dict):
+            return [obj[key] for key in self.keys]
+        return [getattr(obj, key) for key in self.keys]
 
-from yatube.settings import DEF_NUM_POSTS
+    def _to_python(self, values):
+        if len(values) != len(self.keys):
+            raise ValueError('Cursor does not match paginator keys')
+        opts = self.object_list.model._meta
+        position = [
+            opts.get_field(key).to_python(value)
+            for key, value in zip(self.keys, values)
+        ]
+        # to_python пропускает null, а сравнивать с NULL в запросе нельзя.
+        if None in position:
+            raise ValueError('Cursor contains null values')
+        return position
 
+    def _fetch(self, direction, position, limit):
+        return fetch_window(
+            self.object_list, self.keys, direction, position, limit
+        )
 
-def paginator(list_of_posts, request):
-    paginator = Paginator(list_of_posts, DEF_NUM_POSTS)
+
+def fetch_window(queryset, keys, direction, position, limit):
+    """До `limit` строк строго старше (или новее) позиции `position`."""
+    return list(keyset_window(queryset, keys, direction, position, limit))
+
+
+def keyset_window(queryset, keys, direction, position, limit):
+    if direction == NEWER:
+        lookup, order = 'gt', list(keys)
+    else:
+        lookup, order = 'lt', ['-' + key for key in keys]
+    if position is not None:
+        condition = Q()
+        for i, key in enumerate(keys):
+            equal = dict(zip(keys[:i], position[:i]))
+            condition |= Q(**equal, **{f'{key}__{lookup}': position[i]})
+        # Избыточная граница по первому ключу превращает OR в поиск
+        # по диапазону индекса вместо сканирования с начала.
+        bound = {f'{keys[0]}__{lookup}e': position[0]}
+        queryset = queryset.filter(condition, **bound)
+    return queryset.order_by(*order)[:limit]
+
+
+def feed_count_key(*parts):
+    return ':'.join(['feed_count', *map(str, parts)])
+
+
+def group_choices():
+    """Пары (id, название) всех групп; ключ сбрасывают сигналы Group."""
+    return cache.get_or_set(
+        GROUP_CHOICES_KEY,
+        lambda: list(Group.objects.order_by('title').values_list(
+            'pk', 'title'
+        )),
+        None,
+    )
+
+
+class CachedCountPaginator(Paginator):
+    """Нумерованные страницы с закэшированным числом постов ленты.
+
+    COUNT(*) выполняется один раз на `count_key` и живёт в кэше, пока
+    сигналы `Post` не сбросят ключ. `page_window` - ограниченное окно
+    номеров вокруг текущей страницы вместо всего `page_range`.
+    """
+
+    def __init__(self, object_list, per_page, count_key=None,
+                 window=PAGE_WINDOW):
+        super().__init__(object_list, per_page)
+        self.count_key = count_key
+        self.window = window
+        self.page_window = range(1, 2)
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        return cache.get_or_set(
+            self.count_key,
+            lambda: self.object_list.count(),
+            FEED_COUNT_TIMEOUT,
+        )
+
+    def page(self, number):
+        page = super().page(number)
+        self.page_window = range(
+            max(1, page.number - self.window),
+            min(self.num_pages, page.number + self.window) + 1,
+        )
+        return page
+
+
+def paginator(list_of_posts, request, keys=('pub_date', 'id'),
+              count_key=None):
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None:
+        paginator = CachedCountPaginator(
+            list_of_posts, DEF_NUM_POSTS, count_key
+        )
+        return paginator.get_page(page_number)
+    paginator = KeysetPaginator(list_of_posts, DEF_NUM_POSTS, keys)
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+def comments_page(post, cursor):
+    comments = post.comments.select_related('author')
+    paginator = KeysetPaginator(
+        comments, COMMENTS_PER_PAGE, keys=('created', 'id')
+    )
+    return paginator.get_page(cursor)
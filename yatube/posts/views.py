@@ -1,32 +1,53 @@
 import requests
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+from django.views.decorators.http import condition, require_GET
 
+from . import thumbnails
+from .export import CONTENT_TYPES, FORMATS, export_lines, export_queryset
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post
-from .serializers import PostSerializer
-from .utils import paginator
+from .page_cache import (api_post_etag, api_post_last_modified, group_scopes,
+                         index_scopes, post_scopes, profile_scopes,
+                         search_scopes, versioned_cache_page)
+from .search import SearchPaginator
+from .serializers import (POST_API_FIELDS, CommentSerializer, PostSerializer,
+                          api_fields, post_row)
+from .timeline import follow_feed
+from .uploads import image_upload
+from .utils import KeysetPaginator, comments_page, feed_count_key, paginator
 
 User = get_user_model()
 
 
-@cache_page(1 * 20, key_prefix='index_page')
+@versioned_cache_page(index_scopes)
 def index(request):
     post_list = Post.objects.all().select_related('author', 'group')
-    page_obj = paginator(post_list, request)
+    page_obj = paginator(
+        post_list, request, count_key=feed_count_key('index')
+    )
+    thumbnails.prefetch(page_obj)
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@versioned_cache_page(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     post_list = group.posts.all().select_related('author', 'group')
-    page_obj = paginator(post_list, request)
+    page_obj = paginator(
+        post_list, request, count_key=feed_count_key('group', group.id)
+    )
+    thumbnails.prefetch(page_obj)
     context = {
         'page_obj': page_obj,
         'group': group,
@@ -34,10 +55,16 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@versioned_cache_page(profile_scopes)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all().select_related('group')
-    page_obj = paginator(post_list, request)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    post_list = author.posts.all().select_related('author', 'group')
+    page_obj = paginator(
+        post_list, request, count_key=feed_count_key('author', author.id)
+    )
+    thumbnails.prefetch(page_obj)
     failed_message = None
     if request.user.is_authenticated:
         if request.user.id == author.id:
@@ -60,9 +87,29 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@versioned_cache_page(search_scopes)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    posts = Post.objects.select_related('author', 'group')
+    page_obj = SearchPaginator(
+        posts, settings.DEF_NUM_POSTS, query
+    ).get_page(request.GET.get('cursor'))
+    thumbnails.prefetch(page_obj)
+    context = {
+        'page_obj': page_obj,
+        'query': query,
+        # Курсорные ссылки пагинатора должны сохранять запрос.
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@versioned_cache_page(post_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    comment_list = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id
+    )
+    comment_list = comments_page(post, request.GET.get('cursor'))
     form = CommentForm(
         request.POST or None,
     )
@@ -74,11 +121,14 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@image_upload
 @login_required
+@transaction.atomic
 def post_create(request):
     form = PostForm(
-        request.POST or None,
-        files=request.FILES or None
+        request.POST if request.method == 'POST' else None,
+        files=request.FILES or None,
+        upload_errors=request.upload_errors,
     )
     if request.method == 'POST':
         if form.is_valid():
@@ -91,19 +141,29 @@ def post_create(request):
                   {'form': form})
 
 
+@image_upload
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     is_edit = True
     if post.author != request.user:
         return redirect('posts:post_detail', post_id)
     form = PostForm(
-        request.POST or None,
+        request.POST if request.method == 'POST' else None,
         files=request.FILES or None,
-        instance=post
+        instance=post,
+        upload_errors=request.upload_errors,
     )
     if form.is_valid():
-        post.save()
+        # Только поля формы: comments_count меняется одновременно
+        # с правкой через F(), а размеры картинки пишет фоновая задача.
+        fields = [*form.Meta.fields, 'edited']
+        if 'image' in form.changed_data:
+            post.image_width = post.image_height = None
+            post.image_placeholder = ''
+            fields += ['image_width', 'image_height', 'image_placeholder']
+        post.save(update_fields=fields)
         return redirect('posts:post_detail', post_id)
     context = {
         'form': form,
@@ -114,6 +174,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
@@ -127,8 +188,8 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginator(post_list, request)
+    page_obj = follow_feed(request.user, request)
+    thumbnails.prefetch(page_obj)
     context = {
         'page_obj': page_obj,
     }
@@ -136,6 +197,7 @@ def follow_index(request):
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user.id != author.id:
@@ -144,6 +206,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     unfollowing_author = get_object_or_404(User, username=username)
     get_object_or_404(
@@ -154,8 +217,135 @@ def profile_unfollow(request, username):
     return redirect('posts:profile', username=unfollowing_author)
 
 
+@condition(etag_func=api_post_etag,
+           last_modified_func=api_post_last_modified)
 def get_post(request, pk: int):
     if request.method == 'GET':
         post = get_object_or_404(Post, pk=pk)
         serializer = PostSerializer(post)
         return JsonResponse(serializer.data)
+
+
+@require_GET
+def get_comments(request, pk: int):
+    post = get_object_or_404(Post.objects.only('id'), pk=pk)
+    page = comments_page(post, request.GET.get('cursor'))
+    serializer = CommentSerializer(page, many=True)
+    return JsonResponse({
+        'results': serializer.data,
+        'older': page.paginator.older_cursor,
+        'newer': page.paginator.newer_cursor,
+    })
+
+
+def _api_limit(request):
+    try:
+        limit = int(request.GET.get('limit', settings.API_PAGE_SIZE))
+    except ValueError:
+        limit = settings.API_PAGE_SIZE
+    return max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+
+
+def _api_since(request):
+    """Дата из ?since или None, если это не дата."""
+    try:
+        # ValueError - правильный формат, но дата вроде 13-го месяца.
+        return parse_datetime(request.GET['since'])
+    except ValueError:
+        return None
+
+
+@require_GET
+def posts_api(request):
+    """Список постов: курсор по (pub_date, id), фильтры и выбор полей.
+
+    ?ids=1,2,3 возвращает посты по id одним in_bulk в порядке запроса.
+    """
+    fields = api_fields(request.GET.get('fields'))
+    paths = {POST_API_FIELDS[name] for name in fields}
+    posts = Post.objects.all()
+    if 'author__username' in paths:
+        posts = posts.select_related('author')
+    if 'group__slug' in paths:
+        posts = posts.select_related('group')
+
+    if request.GET.get('ids'):
+        try:
+            ids = [int(pk) for pk in request.GET['ids'].split(',')]
+        except ValueError:
+            return JsonResponse({'error': 'ids must be integers'}, status=400)
+        found = posts.in_bulk(ids[:settings.API_MAX_PAGE_SIZE])
+        return JsonResponse({
+            'results': [post_row(found[pk], fields) for pk in ids
+                        if pk in found],
+        })
+
+    if request.GET.get('author'):
+        posts = posts.filter(author__username=request.GET['author'])
+    if request.GET.get('group'):
+        posts = posts.filter(group__slug=request.GET['group'])
+    if request.GET.get('since'):
+        since = _api_since(request)
+        if since is None:
+            return JsonResponse(
+                {'error': 'since must be an ISO 8601 datetime'}, status=400
+            )
+        posts = posts.filter(pub_date__gte=since)
+
+    rows = posts.values(*paths | {'id', 'pub_date'})
+    page = KeysetPaginator(rows, _api_limit(request)).get_page(
+        request.GET.get('cursor')
+    )
+    return JsonResponse({
+        'results': [post_row(row, fields) for row in page],
+        'older': page.paginator.older_cursor,
+        'newer': page.paginator.newer_cursor,
+    })
+
+
+@require_GET
+def search_api(request):
+    """Поиск по тексту постов, лучшие совпадения первыми.
+
+    ?q= - слова запроса (последнее ищется как префикс), ?fields=
+    и ?limit= - как у posts_api; next/previous - курсоры соседних страниц.
+    """
+    fields = api_fields(request.GET.get('fields'))
+    posts = Post.objects.select_related('author', 'group')
+    page = SearchPaginator(
+        posts, _api_limit(request), request.GET.get('q')
+    ).get_page(request.GET.get('cursor'))
+    return JsonResponse({
+        'results': [
+            dict(post_row(post, fields), score=post.score) for post in page
+        ],
+        'next': page.paginator.older_cursor,
+        'previous': page.paginator.newer_cursor,
+    })
+
+
+@staff_member_required
+@require_GET
+def posts_export(request):
+    """Потоковая выгрузка постов в NDJSON или CSV, только для персонала.
+
+    ?format=ndjson|csv, ?comments=1, фильтры author, group и
+    полуинтервал дат [since, until).
+    """
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return JsonResponse({'error': 'format must be ndjson or csv'},
+                            status=400)
+    try:
+        posts = export_queryset(
+            request.GET.get('author'), request.GET.get('group'),
+            request.GET.get('since'), request.GET.get('until'),
+        )
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    response = StreamingHttpResponse(
+        export_lines(fmt, posts, bool(request.GET.get('comments'))),
+        content_type=CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="posts.{fmt}"'
+    return response
@@ -1,5 +1,12 @@
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
 from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from core import jobs
 
 
 User = get_user_model()
@@ -9,3 +16,63 @@ class CreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         model = User
         fields = ('first_name', 'last_name', 'username', 'email')
+
+
+def send_password_reset(user_id, domain, site_name, protocol,
+                        subject_template_name, email_template_name,
+                        from_email, html_email_template_name=None):
+    """Фоновая задача: письмо со ссылкой сброса пароля.
+
+    Токен и ссылка создаются здесь, а не в запросе: в очереди (и в
+    админке задач) лежит только id пользователя, по которому войти в
+    чужой аккаунт нельзя.
+    """
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if user is None or not user.has_usable_password():
+        return
+    email = getattr(user, User.get_email_field_name())
+    if not email:
+        return
+    context = {
+        'email': email,
+        'domain': domain,
+        'site_name': site_name,
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'user': user,
+        'token': default_token_generator.make_token(user),
+        'protocol': protocol,
+    }
+    subject = loader.render_to_string(subject_template_name, context)
+    message = EmailMultiAlternatives(
+        ''.join(subject.splitlines()),
+        loader.render_to_string(email_template_name, context),
+        from_email, [email],
+    )
+    if html_email_template_name is not None:
+        message.attach_alternative(
+            loader.render_to_string(html_email_template_name, context),
+            'text/html',
+        )
+    message.send()
+
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Письмо для сброса пароля отправляет фоновая задача.
+
+    В очередь уходят id пользователя и адрес сайта из запроса, токен
+    создаёт и шаблоны рендерит сама задача send_password_reset.
+    """
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        # Повторные нажатия, пока письмо ждёт, не ставят новых писем;
+        # у пользователей с общим адресом письма свои.
+        user = context['user']
+        jobs.enqueue(
+            send_password_reset, user.pk, context['domain'],
+            context['site_name'], context['protocol'],
+            subject_template_name, email_template_name, from_email,
+            html_email_template_name,
+            dedupe_key=f'password_reset:{user.pk}',
+        )
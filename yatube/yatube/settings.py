@@ -1,4 +1,5 @@
 import os
+import sys
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -19,6 +20,34 @@ INTERNAL_IPS = [
 
 # DEF_NUM_POSTS defines the limit of displayed posts
 DEF_NUM_POSTS = 10
+# Comments shown per page under a post
+COMMENTS_PER_PAGE = 20
+# Page size of the posts list API: default and the most a client may ask for
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 5000
+# How many page numbers to show on each side of the current one
+PAGE_WINDOW = 3
+# Cached feed sizes are dropped by Post signals, the timeout is a safety net
+FEED_COUNT_TIMEOUT = 60 * 60 * 24
+# Max number of posts kept in each user's materialized follow feed
+TIMELINE_LENGTH = 800
+# Fan-out trims roughly one follower timeline in this many
+TIMELINE_TRIM_EVERY = 50
+# Authors with this many followers are merged into feeds at read time
+# instead of being pushed to every follower's timeline
+TIMELINE_CELEBRITY_FOLLOWERS = 10000
+# They are pushed again only after losing this share of the threshold
+TIMELINE_CELEBRITY_HYSTERESIS = 0.1
+CELEBRITIES_TIMEOUT = 60 * 5
+# New posts of authors with more followers are fanned out by a background
+# job instead of the request that created them
+TIMELINE_FANOUT_INLINE = 200
+# Rows read per query when streaming an export of posts and comments
+EXPORT_CHUNK_SIZE = 2000
+# Records committed per transaction by the bulk import command
+IMPORT_CHUNK_SIZE = 10000
+# Admin changelists count rows only up to this many, then estimate
+ADMIN_COUNT_LIMIT = 10000
 
 # Application definition
 
@@ -126,8 +155,85 @@ STATIC_URL = "/static/"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Limits for post images, enforced while the upload streams to disk
+POST_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40_000_000
+
+# Thumbnail geometries used by templates, by name; all of them are
+# generated in the background as soon as a post with an image is saved
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+    'card_480': ('480x170', {'crop': 'center', 'upscale': True}),
+    'card_webp': ('960x339', {
+        'crop': 'center', 'upscale': True, 'format': 'WEBP'
+    }),
+    'card_480_webp': ('480x170', {
+        'crop': 'center', 'upscale': True, 'format': 'WEBP'
+    }),
+}
+# Feed card <picture>: rendered size and srcset candidates per MIME type,
+# preferred type first; variants Pillow cannot encode are skipped
+POST_CARD_SIZE = (960, 339)
+POST_CARD_SRCSET = {
+    'image/webp': [('card_480_webp', 480), ('card_webp', 960)],
+    'image/jpeg': [('card_480', 480), ('card', 960)],
+}
+# Width of the blurred inline placeholder shown until the image loads
+POST_PLACEHOLDER_WIDTH = 16
+# JPEG draft decoding, early EXIF rotation and reduce() before resampling
+THUMBNAIL_ENGINE = 'posts.thumbnail_engine.Engine'
+# sorl key-value store with an in-process LRU and page-wide multi-get
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'
+THUMBNAIL_LRU_SIZE = 10000
+THUMBNAIL_LRU_TIMEOUT = 60 * 5
+
+# Background jobs (core.jobs): threads per run_workers process, attempts
+# before a job is marked failed and the first retry delay in seconds,
+# doubled on every further attempt
+JOB_WORKERS = 2
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+# How often idle workers poll the queue, seconds
+JOB_POLL_INTERVAL = 1
+# A job running longer than this is considered lost with its worker
+JOB_LEASE = 60 * 10
+# Finished jobs are kept this long for latency stats
+JOB_KEEP_DONE = 60 * 60 * 24
+# Run jobs right after the commit in the same process instead of queueing
+# them for run_workers
+JOB_QUEUE_INLINE = False
+
+# Pages are invalidated by model signals, so they can live for hours
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
+# After that one request rebuilds a page while the others get the stale
+# copy, kept this many seconds longer
+PAGE_CACHE_STALE = 60 * 5
+# Requests with no copy at all wait this long for a page being built by
+# another request before building it themselves
+PAGE_CACHE_WAIT = 2
+PAGE_CACHE_LOCK_TIMEOUT = 30
+# XFetch early refresh: larger values refresh pages earlier before expiry
+PAGE_CACHE_BETA = 1.0
+
+# Per-process LRU (L1) over a SQLite file shared by all processes (L2);
+# L1 entries are rechecked against L2 version stamps after
+# RECHECK_INTERVAL seconds, so other processes' writes show up by then
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'L1_MAX_BYTES': 32 * 1024 * 1024,
+            'RECHECK_INTERVAL': 1,
+        },
     }
 }
+
+# Test runs (manage.py test and pytest) get a per-process cache, so that
+# pages cached by one run don't leak into the next one with another
+# database, and run background jobs in place, as there are no workers
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING:
+    CACHES['default']['LOCATION'] = ':memory:'
+    JOB_QUEUE_INLINE = True